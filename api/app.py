@@ -9,9 +9,12 @@ from slowapi.middleware import SlowAPIMiddleware
 
 from .config import get_settings
 from .create_admin import deta_init
+from .db import base_clients
 from .exceptions import rate_limit_exceeded_handler
-from .fs import media
+from .fs import media, media_cache
+from .models.loader import LoaderMiddleware
 from .models.upload import UploadSession
+from .rebuild_indexes import build_indexes, collect_pages, rebuild_indexes, reconcile_counts, reconcile_page_refs
 
 global_settings = get_settings()
 
@@ -29,10 +32,24 @@ if getenv("DETA_RUNTIME"):
     @app.lib.cron()
     async def setup_media(event):
         print("Cleaning up the lingering sessions...")
-        await UploadSession.flush()
-        media.rmtree("blobs")
+        result = await UploadSession.flush()
+        if result.failed:
+            print(f"{len(result.failed)} sessions couldn't be deleted, they'll be retried on the next run.")
+        await media.rmtree("blobs")
+        print("Building the new indexes...")
+        await build_indexes()
+        print("Reconciling the counters...")
+        await reconcile_counts()
+        await reconcile_page_refs()
+        print("Removing the unreferenced pages...")
+        await collect_pages()
         print("Done with the clean up.")
 
+    @app.lib.run(action="rebuild_indexes")
+    async def rebuild_indexes_action(event):
+        await rebuild_indexes()
+        return "Indexes rebuilt"
+
 
 def get_remote_address(request: Request):
     ip = (
@@ -49,14 +66,19 @@ limiter = Limiter(key_func=get_remote_address, default_limits=["60/minute"])
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(LoaderMiddleware)
 
 
 @app.on_event("startup")
 async def startup_event():
     log.info("Starting up...")
+    if media_cache:
+        # The files may have changed since the copies were made
+        media_cache.clear()
     await deta_init()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     log.info("Shutting down...")
+    await base_clients.close()
@@ -0,0 +1,111 @@
+"""Compares the streamed Drive copy with the previous copy through a temporary file
+
+The Drive is replaced by a stand-in keeping the files in memory, so that only the local work is measured.
+Run with `python -m api.benchmarks.drive_copy`, the settings must be available in the environment.
+"""
+import os
+from tempfile import TemporaryFile
+from time import perf_counter
+
+from ..fs import Drive
+
+# A chapter of 100 pages, and a big file uploaded in parts
+FILES = {"page": (1024 * 1024, 100), "archive": (64 * 1024 * 1024, 2)}
+
+
+class StreamingBody:
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+
+    def iter_chunks(self, chunk_size: int):
+        for i in range(0, len(self.data), chunk_size):
+            yield bytes(self.data[i:][:chunk_size])
+
+    def close(self):
+        pass
+
+
+class LocalDrive:
+    """Stand-in for the Drive of the SDK, with the methods used by `api.fs.Drive`"""
+
+    def __init__(self):
+        self.files = {}
+        self.uploads = {}
+
+    def put(self, name: str, data):
+        self.files[name] = data.read() if hasattr(data, "read") else bytes(data)
+
+    def get(self, name: str):
+        return StreamingBody(self.files[name]) if name in self.files else None
+
+    def delete_many(self, names: list[str]):
+        for name in names:
+            self.files.pop(name, None)
+
+    def list(self, prefix: str, last=None):
+        return {"names": [name for name in self.files if name.startswith(prefix)]}
+
+    def _start_upload(self, name: str):
+        upload_id = f"upload_{len(self.uploads)}"
+        self.uploads[upload_id] = []
+        return upload_id
+
+    def _upload_part(self, name: str, chunk: bytes, upload_id: str, part: int):
+        self.uploads[upload_id].append(chunk)
+
+    def _finish_upload(self, name: str, upload_id: str):
+        self.files[name] = b"".join(self.uploads.pop(upload_id))
+
+    def _abort_upload(self, name: str, upload_id: str):
+        del self.uploads[upload_id]
+
+
+class LocalBase:
+    def __init__(self):
+        self.items = {}
+
+    def put(self, item: dict):
+        self.items[item["key"]] = item
+
+    def get(self, key: str):
+        return self.items.get(key)
+
+    def delete(self, key: str):
+        self.items.pop(key, None)
+
+
+def temp_file_copy(drive: Drive, source: str, dest: str):
+    """The previous implementation of `Drive.copy`"""
+    big_file = drive.get(source)
+
+    with TemporaryFile() as f:
+        for chunk in big_file.iter_chunks(4096):
+            f.write(chunk)
+        big_file.close()
+        f.seek(0)
+        drive.put(dest, f)
+
+
+def main():
+    drive = Drive("benchmark")
+    clients = LocalDrive(), LocalBase()
+    drive.connect = lambda: clients
+
+    print(f"{'file':<10}{'temp file':>14}{'streamed':>14}{'speedup':>10}")
+    for name, (size, amount) in FILES.items():
+        drive.put(name, os.urandom(size))
+        durations = []
+        for copy in (temp_file_copy, Drive.copy):
+            start = perf_counter()
+            for i in range(amount):
+                copy(drive, name, f"{name}_{i}")
+            durations.append(perf_counter() - start)
+            assert all(drive.drive.files[f"{name}_{i}"] == drive.drive.files[name] for i in range(amount))
+
+        mb = size * amount / 1024 / 1024
+        old, new = (mb / duration for duration in durations)
+        print(f"{name:<10}{old:>10,.0f}MB/s{new:>10,.0f}MB/s{new / old:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
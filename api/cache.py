@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Optional
+
+from prometheus_client import Counter
+
+from .config import get_settings
+
+settings = get_settings()
+
+cache_hits = Counter("monochrome_entity_cache_hits_total", "Entity cache hits", ["db_name"])
+cache_misses = Counter("monochrome_entity_cache_misses_total", "Entity cache misses", ["db_name"])
+
+
+class EntityCache:
+    """Interface of the caches holding the raw database rows, keyed by their Deta key"""
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class NullCache(EntityCache):
+    def get(self, key: str):
+        return None
+
+    def set(self, key: str, value: dict):
+        pass
+
+    def delete(self, key: str):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LRUCache(EntityCache):
+    """In-process LRU cache whose entries also expire after `ttl` seconds"""
+
+    def __init__(self, db_name: str, size: int, ttl: float):
+        self.db_name = db_name
+        self.size = size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < monotonic():
+            self.entries.pop(key, None)
+            cache_misses.labels(self.db_name).inc()
+            return None
+
+        self.entries.move_to_end(key)
+        cache_hits.labels(self.db_name).inc()
+        return entry[1]
+
+    def set(self, key: str, value: dict):
+        current = self.entries.get(key)
+        # A slower request must not replace a newer version of the row
+        if current is not None and current[1].get("version", 0) > value.get("version", 0):
+            return
+
+        self.entries[key] = (monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def delete(self, key: str):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+
+def lru_cache_factory(db_name: str) -> EntityCache:
+    size = settings.entity_cache_sizes.get(db_name, settings.entity_cache_size)
+    ttl = settings.entity_cache_ttls.get(db_name, settings.entity_cache_ttl)
+    if size <= 0 or ttl <= 0:
+        return NullCache()
+    return LRUCache(db_name, size, ttl)
+
+
+class EntityCaches:
+    """Lazily creates one cache per database, the factory can be replaced to plug another backend"""
+
+    def __init__(self, factory: Callable[[str], EntityCache] = lru_cache_factory):
+        self.factory = factory
+        self.caches: dict[str, EntityCache] = {}
+
+    def get(self, db_name: str) -> EntityCache:
+        if db_name not in self.caches:
+            self.caches[db_name] = self.factory(db_name)
+        return self.caches[db_name]
+
+    def clear(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+
+entity_caches = EntityCaches()
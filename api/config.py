@@ -8,6 +8,9 @@ log = logging.getLogger(__name__)
 
 class Settings(BaseSettings):
     deta_project_key: str
+    deta_base_connection_limit: int = Field(100, ge=0)
+    deta_base_keepalive_timeout: float = Field(30, gt=0)
+    db_concurrency_limit: int = Field(16, gt=0)
     cors_origins: str = ""
 
     jwt_secret_key: str
@@ -15,8 +18,23 @@ class Settings(BaseSettings):
     jwt_access_token_expire_minutes: int = 60
 
     temp_path: str = "/tmp"
+    media_chunk_size: int = Field(64 * 1024, gt=0)
+    drive_concurrency_limit: int = Field(8, gt=0)
+    page_move_concurrency_limit: int = Field(4, gt=0)
+    page_move_retries: int = Field(3, ge=0)
+    media_cache_size: int = Field(128 * 1024 * 1024, ge=0)
+    media_variant_sizes: list[int] = [160, 320, 640, 1280]
+    media_encodings: list[str] = ["webp", "avif"]
+    image_concurrency_limit: int = Field(2, gt=0)
 
     max_page_limit: int = Field(50, gt=0)
+
+    entity_cache_size: int = Field(1024, ge=0)
+    entity_cache_ttl: float = Field(60, ge=0)
+    entity_cache_sizes: dict[str, int] = {}
+    entity_cache_ttls: dict[str, float] = {}
+    facet_counts_ttl: float = Field(60, ge=0)
+    scan_groups_ttl: float = Field(300, ge=0)
     allow_registration: bool = False
 
 
@@ -1,4 +1,5 @@
 import asyncio
+from base64 import urlsafe_b64encode
 from logging import getLogger
 from os import getenv
 from uuid import uuid4
@@ -42,6 +43,23 @@ async def main():
     await db.put(user)
     await db.close()
 
+    # Keeps the user listing index (api/models/user.py) in sync, it's keyed by `username#id`
+    db_index = deta.AsyncBase("index_users_by_username")
+    await db_index.put({**user, "key": f"{USERNAME}#{uuid}"})
+    await db_index.close()
+
+    # And the username lookup (api/models/lookup.py), keyed by `username:<base64 username>`
+    encoded_username = urlsafe_b64encode(USERNAME.encode()).decode().rstrip("=")
+    db_lookup = deta.AsyncBase("lookup_users")
+    await db_lookup.put({"key": f"username:{encoded_username}", "id": str(uuid)})
+    await db_lookup.close()
+
+    # And the amount of users, which is served as the total of the listing
+    db_counters = deta.AsyncBase("counters")
+    counter = await db_counters.get("users_by_username")
+    await db_counters.put({"key": "users_by_username", "value": (counter["value"] if counter else 0) + 1})
+    await db_counters.close()
+
 
 async def deta_init():
     PROJECT_KEY = getenv("DETA_PROJECT_KEY")
@@ -63,8 +81,8 @@ async def deta_init():
         return
 
     logger.info("First install, creating default user...")
-    
-    await db_init.put({"key":"initialized"})
+
+    await db_init.put({"key": "initialized"})
     await db_init.close()
 
     user = {
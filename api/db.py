@@ -1,6 +1,52 @@
+from aiohttp import ClientSession, TCPConnector
 from deta import Deta
 
 from .config import get_settings
 
 settings = get_settings()
 deta = Deta(settings.deta_project_key)
+
+
+class BaseClients:
+    """Keeps one long-lived Deta Base client per database, sharing a keep-alive connection pool"""
+
+    def __init__(self):
+        self.clients = {}
+        self.connector = None
+
+    async def get(self, db_name: str):
+        client = self.clients.get(db_name)
+        if client is not None:
+            return client
+
+        if self.connector is None or self.connector.closed:
+            self.connector = TCPConnector(
+                limit=settings.deta_base_connection_limit,
+                keepalive_timeout=settings.deta_base_keepalive_timeout,
+            )
+
+        client = deta.AsyncBase(db_name)
+        # The SDK doesn't expose the connector, so the client's session is swapped for one using the shared pool
+        default_session = client._session
+        client._session = ClientSession(
+            headers=default_session.headers,
+            raise_for_status=True,
+            connector=self.connector,
+            connector_owner=False,
+        )
+        self.clients[db_name] = client
+        await default_session.close()
+
+        return client
+
+    async def close(self):
+        clients, self.clients = self.clients, {}
+        for client in clients.values():
+            await client.close()
+
+        if self.connector is not None:
+            await self.connector.close()
+            self.connector = None
+
+
+base_clients = BaseClients()
@@ -0,0 +1,15 @@
+from hashlib import sha1
+from typing import Optional
+
+
+def make_etag(*parts: str) -> str:
+    return f'"{sha1(chr(0).join(parts).encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Tells if the If-None-Match header holds the ETag, the weak comparison being used as for GET requests"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
@@ -119,3 +119,16 @@ class PermissionsHTTPException(HTTPException):
     @staticmethod
     def open_api(msg: Optional[str] = None):
         return _open_api("Insufficient permissions", msg)
+
+
+class RangeNotSatisfiableHTTPException(HTTPException):
+    def __init__(self, size: int, msg: Optional[str] = None):
+        super().__init__(
+            status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+            detail=msg if msg else "Requested range not satisfiable",
+            headers={"Content-Range": f"bytes */{size}"},
+        )
+
+    @staticmethod
+    def open_api(msg: Optional[str] = None):
+        return _open_api("Requested range not satisfiable", msg)
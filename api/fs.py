@@ -1,15 +1,374 @@
-from tempfile import TemporaryFile
-from typing import Optional
+import asyncio
+import mimetypes
+import os
+import shutil
+import threading
+from base64 import urlsafe_b64encode
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from hashlib import sha256
+from itertools import chain
+from math import inf
+from tempfile import mkstemp
+from time import monotonic
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, TypeVar
 
+from .config import get_settings
 from .db import deta
 
+settings = get_settings()
+
+T = TypeVar("T")
+
+# Size of the chunks read when hashing the files written to the Drive
+HASH_CHUNK_SIZE = 64 * 1024
+
+# The Drive uploads the files bigger than a part in several parts, of 5 to 10 MiB
+UPLOAD_PART_SIZE = 10 * 1024 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# The resized copies of a file are stored in `variants/<file>/`
+VARIANTS_PATH = "variants"
+
+# The pages of the chapters are stored once, under the hash of their content
+PAGES_PATH = "pages"
+
+# Amount of metadata of the pages and their variants kept in memory by the media cache, as it never changes once
+# the encodings of the page are made. Until then, the metadata of a page is only kept for `PENDING_META_TTL` seconds
+META_CACHE_SIZE = 16 * 1024
+PENDING_META_TTL = 60
+
+_signatures = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+def guess_type(name: str, head: bytes = b"") -> str:
+    """Content type of a file, from its first bytes or else from its name"""
+    for signature, content_type in _signatures:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+
+def page_path(digest: str):
+    return f"{PAGES_PATH}/{digest}.jpg"
+
+
+def variant_of(variant: str) -> str:
+    """The file a variant was made from"""
+    return os.path.relpath(os.path.dirname(variant), VARIANTS_PATH)
+
+
+def immutable(path: str) -> bool:
+    """If the file is a page or one of its variants, whose content never changes"""
+    return path.startswith((f"{PAGES_PATH}/", f"{VARIANTS_PATH}/{PAGES_PATH}/"))
+
+
+def pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def file_size(file) -> Optional[int]:
+    """Size of a file being downloaded from the Drive, as announced by the response"""
+    # The SDK doesn't expose the headers of the response it wraps
+    stream = getattr(file, "_DriveStreamingBody__stream", None)
+    length = stream.getheader("Content-Length") if stream is not None else None
+    return int(length) if length and length.isdigit() else None
+
+
+def iter_file(file, chunk_size: int) -> Iterator[bytes]:
+    """Yields the chunks of a file being downloaded from the Drive, closing it at the end"""
+    try:
+        yield from file.iter_chunks(chunk_size)
+    finally:
+        file.close()
+
+
+def iter_range(file, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+    """Yields the bytes from `start` to `end` included of a file being downloaded from the Drive"""
+    position = 0
+    try:
+        for chunk in file.iter_chunks(chunk_size):
+            chunk_start, position = position, position + len(chunk)
+            if position <= start:
+                continue
+            first, last = max(start - chunk_start, 0), end + 1 - chunk_start
+            yield chunk[first:last]
+            if position > end:
+                break
+    finally:
+        file.close()
+
+
+def iter_parts(chunks: Iterable[bytes], part_size: int) -> Iterator[bytes]:
+    """Regroups the chunks in parts of `part_size` bytes, the last one being smaller"""
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_local_range(local_path: str, start: int, end: int, chunk_size: int) -> Iterator[bytes]:
+    """Yields the bytes from `start` to `end` included of a local file"""
+    with open(local_path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0 and (chunk := f.read(min(chunk_size, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+class MediaCache:
+    """Copies of the Drive files on the local disk, the least recently used ones being evicted past `max_size` bytes
+
+    A missing file is downloaded once for all the requests asking for it at the same time, in a temporary
+    file renamed once complete. The Drive invalidates the copies of the paths it writes or removes, a copy
+    being downloaded at that time is dropped. The sizes are accounted in memory, so each process keeps its
+    copies in its own folder.
+    """
+
+    def __init__(self, parent: str, max_size: int):
+        self.parent = parent
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        # The metadata of the pages and their variants, with the time it expires at
+        self.metas: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self.fills: dict[str, asyncio.Task] = {}
+        self.stale: set[str] = set()
+        # The Drive is also used from the threads of its pool
+        self.lock = threading.Lock()
+
+    @property
+    def root(self):
+        # Resolved when it's used, as the workers may be forked once the cache is made
+        return os.path.join(self.parent, str(os.getpid()))
+
+    def local_path(self, path: str):
+        return os.path.join(self.root, sha256(path.encode()).hexdigest())
+
+    def clear(self):
+        """Removes the copies of this process, along with the ones left by the processes that exited"""
+        with self.lock:
+            shutil.rmtree(self.root, ignore_errors=True)
+            self.entries.clear()
+            self.metas.clear()
+            self.size = 0
+
+        for name in os.listdir(self.parent) if os.path.isdir(self.parent) else ():
+            path = os.path.join(self.parent, name)
+            if not name.isdigit() or not pid_exists(int(name)):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+    def get_meta(self, path: str) -> Optional[dict]:
+        with self.lock:
+            meta, expiry = self.metas.get(path, (None, 0.0))
+            if expiry <= monotonic():
+                self.metas.pop(path, None)
+                return None
+            self.metas.move_to_end(path)
+        return meta
+
+    def set_meta(self, path: str, meta: dict):
+        # A page gets its encodings once they're made, they're written to its metadata
+        pending = path.startswith(f"{PAGES_PATH}/") and "encodings" not in meta
+        with self.lock:
+            self.metas[path] = (meta, monotonic() + PENDING_META_TTL if pending else inf)
+            self.metas.move_to_end(path)
+            while len(self.metas) > META_CACHE_SIZE:
+                self.metas.popitem(last=False)
+
+    def invalidate_meta(self, paths: Iterable[str]):
+        with self.lock:
+            for path in paths:
+                self.metas.pop(path, None)
+
+    def get(self, path: str) -> Optional[str]:
+        with self.lock:
+            if path not in self.entries:
+                return None
+            self.entries.move_to_end(path)
+        return self.local_path(path)
+
+    def _remove(self, path: str):
+        self.size -= self.entries.pop(path)
+        try:
+            os.remove(self.local_path(path))
+        except FileNotFoundError:
+            pass
+
+    def invalidate(self, paths: Iterable[str]):
+        with self.lock:
+            for path in paths:
+                self.metas.pop(path, None)
+                if path in self.fills:
+                    self.stale.add(path)
+                if path in self.entries:
+                    self._remove(path)
+
+    def _download(self, drive: "Drive", path: str) -> Optional[str]:
+        os.makedirs(self.root, exist_ok=True)
+        chunks = iter_file(drive.get(path), settings.media_chunk_size)
+        fd, temp_path = mkstemp(dir=self.root)
+        try:
+            size = 0
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        return None
+                    f.write(chunk)
+
+            with self.lock:
+                if path in self.stale:
+                    return None
+                if path in self.entries:
+                    self._remove(path)
+                os.replace(temp_path, self.local_path(path))
+                self.entries[path] = size
+                self.size += size
+                while self.size > self.max_size:
+                    self._remove(next(iter(self.entries)))
+            return self.local_path(path)
+        finally:
+            chunks.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    async def _fill(self, drive: "AsyncDrive", path: str):
+        try:
+            return await drive.run(self._download, drive.drive, path)
+        finally:
+            with self.lock:
+                del self.fills[path]
+                self.stale.discard(path)
+
+    async def fetch(self, drive: "AsyncDrive", path: str) -> Optional[str]:
+        """Returns the path of the local copy of the file, None if it's too big to be cached"""
+        if local_path := self.get(path):
+            return local_path
+
+        with self.lock:
+            if path not in self.fills:
+                self.fills[path] = asyncio.create_task(self._fill(drive, path))
+            fill = self.fills[path]
+        return await asyncio.shield(fill)
+
 
 class Drive:
-    def __init__(self, name: str, host: Optional[str] = None):
-        self.drive = deta.Drive(name, host)
+    def __init__(self, name: str, host: Optional[str] = None, cache: Optional[MediaCache] = None):
+        self.name = name
+        self.host = host
+        self.cache = cache
+        # The clients of the SDK keep a single connection, each thread of the pool gets its own ones
+        self.local = threading.local()
+        # The metadata of the removed files is deleted row by row, in threads of its own
+        self.meta_executor = ThreadPoolExecutor(settings.db_concurrency_limit, thread_name_prefix=f"{name}_meta")
+
+    def connect(self):
+        """New clients for the files and for the hash and content type of each file, computed when it's written"""
+        return deta.Drive(self.name, self.host), deta.Base(f"{self.name}_meta")
+
+    def _clients(self):
+        if not hasattr(self.local, "clients"):
+            self.local.clients = self.connect()
+        return self.local.clients
+
+    @property
+    def drive(self):
+        return self._clients()[0]
+
+    @property
+    def meta(self):
+        return self._clients()[1]
+
+    @staticmethod
+    def _meta_key(path: str):
+        return urlsafe_b64encode(path.encode()).decode().rstrip("=")
 
     def put(self, name: str, data):
-        return self.drive.put(name, data)
+        digest = sha256()
+        if hasattr(data, "read"):
+            head = data.read(HASH_CHUNK_SIZE)
+            size = len(head)
+            digest.update(head)
+            for chunk in iter(lambda: data.read(HASH_CHUNK_SIZE), b""):
+                size += len(chunk)
+                digest.update(chunk)
+            data.seek(0)
+        else:
+            head, size = bytes(data[:HASH_CHUNK_SIZE]), len(data)
+            digest.update(data)
+
+        res = self.drive.put(name, data)
+        self._written(name, digest, head, size)
+        return res
+
+    def _written(self, name: str, digest, head: bytes, size: int):
+        if self.cache:
+            self.cache.invalidate((name,))
+        # A page is never overwritten, as its name is the hash of its content
+        if not name.startswith(f"{PAGES_PATH}/"):
+            self.remove(self.variants((name,)))
+        self.meta.put(
+            {
+                "key": self._meta_key(name),
+                "etag": f'"{digest.hexdigest()}"',
+                "content_type": guess_type(name, head),
+                "size": size,
+            }
+        )
+
+    def variants(self, names: Iterable[str]) -> list[str]:
+        """The variants of the files, listed once for the files of a same folder
+
+        The variants of a single file, or of the pages whose folder is shared by all the chapters, are listed from
+        the folder of each file.
+        """
+        folders = defaultdict(set)
+        for name in names:
+            if not name.startswith(f"{VARIANTS_PATH}/"):
+                folders[os.path.dirname(name)].add(name)
+
+        variants = []
+        for folder, files in folders.items():
+            if folder in ("", PAGES_PATH) or len(files) == 1:
+                variants += chain.from_iterable(self.ls(os.path.join(VARIANTS_PATH, name, "")) for name in files)
+            else:
+                listed = self.ls(os.path.join(VARIANTS_PATH, folder, ""))
+                variants += (variant for variant in listed if variant_of(variant) in files)
+        return variants
+
+    def update_meta(self, path: str, **fields):
+        self.meta.update(fields, self._meta_key(path))
+        if self.cache:
+            self.cache.invalidate_meta((path,))
+
+    def stat(self, path: str) -> Optional[dict]:
+        """The metadata of a file, files written before it was stored don't have any"""
+        return self.meta.get(self._meta_key(path))
 
     def get(self, path: str):
         file = self.drive.get(path)
@@ -18,22 +377,61 @@ class Drive:
         return file
 
     def copy(self, source: str, dest: str):
-        big_file = self.get(source)
+        """Streams the file to its copy, uploaded in parts if it's bigger than one"""
+        chunks = iter_file(self.get(source), COPY_CHUNK_SIZE)
+        parts = iter_parts(chunks, UPLOAD_PART_SIZE)
+        first, second = next(parts, b""), next(parts, None)
+        if second is None:
+            self.put(dest, first)
+            return
+
+        digest, size = sha256(), 0
+        # The SDK only uploads the file objects in parts, it's done the same way from the downloaded chunks
+        upload_id = self.drive._start_upload(dest)
+        try:
+            for number, part in enumerate(chain((first, second), parts), 1):
+                self.drive._upload_part(dest, part, upload_id, number)
+                digest.update(part)
+                size += len(part)
+        except BaseException:
+            self.drive._abort_upload(dest, upload_id)
+            raise
+        finally:
+            chunks.close()
+        self.drive._finish_upload(dest, upload_id)
+        self._written(dest, digest, first[:HASH_CHUNK_SIZE], size)
 
-        with TemporaryFile() as f:
-            for chunk in big_file.iter_chunks(4096):
-                f.write(chunk)
-            big_file.close()
-            f.seek(0)
-            self.drive.put(dest, f)
+    def content_hash(self, path: str) -> str:
+        """The hash of a file, computed from its content if it was written before the metadata was stored"""
+        if meta := self.stat(path):
+            return meta["etag"].strip('"')
+
+        digest = sha256()
+        for chunk in iter_file(self.get(path), COPY_CHUNK_SIZE):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def store_page(self, source: str, digest: str):
+        """Copies the file to the page of its hash unless that page is already stored, returns if it was copied"""
+        dest = page_path(digest)
+        if source == dest or self.stat(dest):
+            return False
+        self.copy(source, dest)
+        return True
 
     def move(self, source: str, dest: str):
         self.copy(source, dest)
         self.remove([source])
 
     def remove(self, names: list[str]):
+        """Removes the files along with their variants"""
+        names = [*names, *self.variants(names)]
         if names:
-            return self.drive.delete_many(names)
+            list(self.meta_executor.map(lambda name: self.meta.delete(self._meta_key(name)), names))
+            res = self.drive.delete_many(names)
+            if self.cache:
+                self.cache.invalidate(names)
+            return res
 
     def ls(self, path: str):
         res = self.drive.list(prefix=path)
@@ -46,9 +444,89 @@ class Drive:
         return all_items
 
     def rmtree(self, path: str):
-        names = self.ls(path)
-        if names:
-            self.drive.delete_many(names)
+        self.remove(self.ls(path))
+
+
+class AsyncDrive:
+    """Runs the calls of a Drive in a bounded thread pool, so that the transfers don't block the event loop
+
+    The sync `drive` can be used directly by the code already running in the pool.
+    """
+
+    def __init__(self, drive: Drive, executor: ThreadPoolExecutor):
+        self.drive = drive
+        self.executor = executor
+
+    async def run(self, function: Callable[..., T], *args, **kwargs) -> T:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args, **kwargs))
+
+    async def iterate(self, iterator: Iterator[T]) -> AsyncIterator[T]:
+        """Pulls the items of a sync iterator, like `iter_file` or `iter_range`, from the pool"""
+        try:
+            while (item := await self.run(next, iterator, None)) is not None:
+                yield item
+        finally:
+            if hasattr(iterator, "close"):
+                await self.run(iterator.close)
+
+    async def local_copy(self, path: str) -> Optional[str]:
+        """Path of a copy of the file on the local disk, None when the Drive isn't cached or the file too big"""
+        if not self.drive.cache:
+            return None
+        return await self.drive.cache.fetch(self, path)
+
+    async def put(self, name: str, data):
+        return await self.run(self.drive.put, name, data)
+
+    async def stat(self, path: str) -> Optional[dict]:
+        return await self.run(self.drive.stat, path)
+
+    async def cached_stat(self, path: str) -> Optional[dict]:
+        """The metadata of a file, kept in memory for the pages and their variants when the Drive is cached
+
+        It's only used to serve the files, as a page removed by another process may still be in the cache.
+        """
+        cache = self.drive.cache
+        if not cache or not immutable(path):
+            return await self.stat(path)
+        if meta := cache.get_meta(path):
+            return meta
+
+        if meta := await self.stat(path):
+            cache.set_meta(path, meta)
+        return meta
+
+    async def get(self, path: str):
+        return await self.run(self.drive.get, path)
+
+    async def copy(self, source: str, dest: str):
+        return await self.run(self.drive.copy, source, dest)
+
+    async def content_hash(self, path: str) -> str:
+        return await self.run(self.drive.content_hash, path)
+
+    async def store_page(self, source: str, digest: str) -> bool:
+        return await self.run(self.drive.store_page, source, digest)
+
+    async def move(self, source: str, dest: str):
+        return await self.run(self.drive.move, source, dest)
+
+    async def remove(self, names: list[str]):
+        return await self.run(self.drive.remove, names)
+
+    async def ls(self, path: str) -> list[str]:
+        return await self.run(self.drive.ls, path)
+
+    async def rmtree(self, path: str):
+        return await self.run(self.drive.rmtree, path)
+
+
+drive_executor = ThreadPoolExecutor(settings.drive_concurrency_limit, thread_name_prefix="drive")
 
+media_cache = (
+    MediaCache(os.path.join(settings.temp_path, "media_cache"), settings.media_cache_size)
+    if settings.media_cache_size
+    else None
+)
 
-media = Drive("media")
+media = AsyncDrive(Drive("media", cache=media_cache), drive_executor)
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from os import path
+from tempfile import TemporaryFile
+from typing import IO, Iterable, Optional, Union
+
+from PIL import Image
+
+from .config import get_settings
+from .fs import VARIANTS_PATH, iter_file, media
+
+try:
+    # Pillow can only encode AVIF with this plugin
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+settings = get_settings()
+
+log = logging.getLogger(__name__)
+
+# Pillow releases the GIL while decoding, resizing and encoding, so the images are processed in threads
+image_executor = ThreadPoolExecutor(settings.image_concurrency_limit, thread_name_prefix="images")
+
+# The formats the pages are also encoded in, when Pillow supports them
+ENCODINGS = {
+    encoding: Image.MIME[Image.registered_extensions()[f".{encoding}"]]
+    for encoding in settings.media_encodings
+    if f".{encoding}" in Image.registered_extensions()
+}
+
+_variants: dict[str, asyncio.Task] = {}
+
+
+async def run(function, *args):
+    return await asyncio.get_running_loop().run_in_executor(image_executor, function, *args)
+
+
+def variant_path(file: str, width: Optional[int] = None, height: Optional[int] = None, extension: str = "jpg"):
+    size = "".join(f"{axis}{value}" for axis, value in (("w", width), ("h", height)) if value)
+    return path.join(VARIANTS_PATH, file, f"{size or 'full'}.{extension}")
+
+
+def resize(image: Union[str, IO[bytes]], width: Optional[int], height: Optional[int]):
+    """Returns a JPEG of the image fitting in the size, the image is never enlarged"""
+    with Image.open(image) as im:
+        im = im.convert("RGB")
+        im.thumbnail((width or im.width, height or im.height), Image.LANCZOS)
+        f = TemporaryFile()
+        im.save(f, "JPEG", quality=85, optimize=True)
+    f.seek(0)
+    return f
+
+
+def encode(image: Union[str, IO[bytes]], encodings: Iterable[str]):
+    """Returns the image encoded in each of the formats"""
+    files = {}
+    with Image.open(image) as im:
+        for encoding in encodings:
+            files[encoding] = TemporaryFile()
+            im.save(files[encoding], encoding.upper(), quality=80)
+            files[encoding].seek(0)
+    return files
+
+
+@asynccontextmanager
+async def open_source(file: str):
+    """The local copy of a media file if it's cached, or else a temporary file it's downloaded in"""
+    if local_path := await media.local_copy(file):
+        yield local_path
+        return
+
+    with TemporaryFile() as source:
+        async for chunk in media.iterate(iter_file(await media.get(file), settings.media_chunk_size)):
+            source.write(chunk)
+        source.seek(0)
+        yield source
+
+
+async def _make_variant(file: str, width: Optional[int], height: Optional[int], dest: str):
+    async with open_source(file) as source:
+        variant = await run(resize, source, width, height)
+
+    with variant:
+        await media.put(dest, variant)
+
+
+async def get_variant(file: str, width: Optional[int], height: Optional[int]) -> str:
+    """Path of the resized copy of a media file, made the first time it's asked for"""
+    dest = variant_path(file, width, height)
+    if await media.cached_stat(dest):
+        return dest
+
+    if dest not in _variants:
+        _variants[dest] = asyncio.create_task(_make_variant(file, width, height, dest))
+        _variants[dest].add_done_callback(lambda _: _variants.pop(dest, None))
+    await asyncio.shield(_variants[dest])
+    return dest
+
+
+async def _make_encodings(file: str):
+    meta = await media.stat(file)
+    if not meta:
+        return
+
+    async with open_source(file) as source:
+        files = await run(encode, source, ENCODINGS)
+
+    encodings = {}
+    for encoding, f in files.items():
+        with f:
+            size = f.seek(0, 2)
+            # Only the encodings smaller than the original are worth sending
+            if size < meta["size"]:
+                f.seek(0)
+                await media.put(variant_path(file, extension=encoding), f)
+                encodings[encoding] = size
+    await media.run(media.drive.update_meta, file, encodings=encodings)
+
+
+async def make_encodings(files: Iterable[str]):
+    """Stores the encodings of the images in the other formats, for the clients accepting them"""
+    if not ENCODINGS:
+        return
+
+    semaphore = asyncio.Semaphore(settings.image_concurrency_limit)
+
+    async def make(file: str):
+        async with semaphore:
+            await _make_encodings(file)
+
+    files = list(files)
+    results = await asyncio.gather(*(make(file) for file in files), return_exceptions=True)
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            log.error("Couldn't encode %s", file, exc_info=result)
+
+
+def accepts(accept: Optional[str], media_type: str):
+    """Tells if the Accept header explicitly allows the media type, a wildcard isn't enough for a new format"""
+    for value in (accept or "").split(","):
+        media_range, *params = (part.strip() for part in value.split(";"))
+        quality = next((param.removeprefix("q=") for param in params if param.startswith("q=")), "1")
+        if media_range == media_type:
+            try:
+                return float(quality) > 0
+            except ValueError:
+                return False
+    return False
+
+
+def negotiate(meta: dict, accept: Optional[str]) -> Optional[str]:
+    """The smallest encoding of a file the client accepts, None if it's the original"""
+    sizes = {
+        encoding: size
+        for encoding, size in meta.get("encodings", {}).items()
+        if encoding in ENCODINGS and accepts(accept, ENCODINGS[encoding])
+    }
+    encoding = min(sizes, key=sizes.get, default=None)
+    return encoding if encoding and sizes[encoding] < meta["size"] else None
@@ -1,46 +1,134 @@
+import asyncio
 from contextlib import asynccontextmanager
+from itertools import islice
 from math import inf
-from typing import Callable, ClassVar, Union
+from typing import AsyncIterable, Awaitable, ClassVar, Iterable, Optional, Union
 from uuid import UUID, uuid4
 
 from aiohttp import ClientError
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, Field
 
+from ..cache import entity_caches
 from ..config import get_settings
-from ..db import deta
+from ..db import base_clients
 from ..exceptions import NotFoundHTTPException, UnprocessableEntityHTTPException
+from .decoder import DecodeError, compile_decoder
+from .pagination import decode_position, encode_cursor
 
 settings = get_settings()
 
+# Maximum amount of items Deta Base accepts in a single put_many
+PUT_MANY_LIMIT = 25
+# Maximum amount of rows requested to Deta in a single fetch
+FETCH_LIMIT = 1000
+
+
+def chunked(items: Iterable, size: int):
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+async def iter_items(db, query, limit: int = inf, page_size: int = FETCH_LIMIT):
+    """Yields the items matching the query while fetching them one page at a time, stopping after `limit` items"""
+    remaining = limit
+    last = None
+    while remaining > 0:
+        res = await db.fetch(query, limit=min(remaining, page_size), last=last)
+        remaining -= len(res.items)
+        for item in res.items:
+            yield item
+
+        if not res.last:
+            break
+        last = res.last
+
+
+async def gather_bounded(calls: Iterable[Awaitable], concurrency: Optional[int] = None) -> list:
+    """Awaits the calls, at most `concurrency` of them at the same time"""
+    semaphore = asyncio.Semaphore(concurrency or settings.db_concurrency_limit)
+
+    async def call(awaitable: Awaitable):
+        async with semaphore:
+            return await awaitable
+
+    return await asyncio.gather(*(call(awaitable) for awaitable in calls))
+
+
+async def put_all(db, items: Iterable[dict], concurrency: Optional[int] = None):
+    """Writes the items in chunks of `PUT_MANY_LIMIT`"""
+    await gather_bounded((db.put_many(chunk) for chunk in chunked(items, PUT_MANY_LIMIT)), concurrency)
+
+
+async def delete_all(db, keys: Iterable[str], concurrency: Optional[int] = None):
+    await gather_bounded((db.delete(key) for key in keys), concurrency)
+
 
 @asynccontextmanager
 async def async_client(db_name: str):
-    client = deta.AsyncBase(db_name)
+    client = await base_clients.get(db_name)
     try:
         yield client
-    except ClientError:
-        UnprocessableEntityHTTPException("Database error")
-    finally:
-        await client.close()
+    except ClientError as e:
+        raise UnprocessableEntityHTTPException("Database error") from e
+
+
+class BulkResult(BaseModel):
+    processed: int = 0
+    failed: dict[str, str] = {}
+
+    def raise_for_failures(self, msg: str = "Some entries couldn't be processed"):
+        if self.failed:
+            raise UnprocessableEntityHTTPException(msg)
 
 
 class DetaBase(BaseModel):
     id: UUID = Field(default_factory=uuid4)
     version: int = 1
     db_name: ClassVar
+    cached: ClassVar[bool] = False
+    indexes: ClassVar[tuple] = ()
+    # Values no other row can hold, they are claimed before the row is written
+    unique: ClassVar[tuple] = ()
+    # Rows read from the database are hydrated without validation, as they were validated when written
+    trusted: ClassVar[bool] = False
 
     def dict(self, *args, **kwargs):
         return {**super().dict(*args, **kwargs), "key": str(self.id)}
 
+    @classmethod
+    def from_db(cls, row: dict):
+        decode = compile_decoder(cls) if cls.trusted else None
+        if decode:
+            try:
+                return decode(row)
+            except DecodeError:
+                pass
+        return cls(**row)
+
+    @classmethod
+    def cache(cls):
+        return entity_caches.get(cls.db_name)
+
     async def save(self):
+        await asyncio.gather(*(index.claim(self) for index in self.unique))
+
         async with async_client(self.db_name) as db:
             self.version += 1
-            await db.put(jsonable_encoder(self))
+            data = jsonable_encoder(self)
+            await asyncio.gather(db.put(data), *(index.put(self) for index in self.indexes))
+
+        if self.cached:
+            self.cache().set(data["key"], data)
 
     async def delete(self):
         async with async_client(self.db_name) as db:
-            await db.delete(str(self.id))
+            await asyncio.gather(db.delete(str(self.id)), *(index.delete(self) for index in self.indexes))
+        await asyncio.gather(*(index.release(self) for index in self.unique))
+
+        if self.cached:
+            self.cache().delete(str(self.id))
         return "OK"
 
     async def update(self, **kwargs):
@@ -48,45 +136,179 @@ class DetaBase(BaseModel):
             new_version = self.version + 1
             new_dict = {**self.dict(), **kwargs, "version": new_version}
             new_instance = self.__class__(**new_dict)
-            await db.put(jsonable_encoder(new_instance))
+            await asyncio.gather(*(index.claim(new_instance, index.keys(self)) for index in self.unique))
+
+            data = jsonable_encoder(new_instance)
+            await asyncio.gather(db.put(data), *(index.replace(self, new_instance) for index in self.indexes))
+            await asyncio.gather(*(index.release(self, index.keys(new_instance)) for index in self.unique))
 
             self.__dict__.update(new_instance.__dict__)
 
-    @staticmethod
-    async def delete_many(instances: list["DetaBase"]):
+        if self.cached:
+            self.cache().set(data["key"], data)
+
+    @classmethod
+    async def save_many(cls, instances: Iterable["DetaBase"], concurrency: Optional[int] = None):
+        # Writes the rows as they are, the save overrides of the models aren't called
+        if cls.indexes or cls.unique:
+            # A bulk write can't tell the new rows from the existing ones, which the counters and claims need
+            raise TypeError(f"The rows of {cls.__name__} must be saved one at a time")
+        instances = list(instances)
+        items = []
         for instance in instances:
-            await instance.delete()
+            instance.version += 1
+            items.append(jsonable_encoder(instance))
+
+        async with async_client(cls.db_name) as db:
+            await put_all(db, items, concurrency)
+
+        if cls.cached:
+            for item in items:
+                cls.cache().set(item["key"], item)
+
+    @staticmethod
+    async def delete_many(
+        instances: Union[Iterable["DetaBase"], AsyncIterable["DetaBase"]], concurrency: Optional[int] = None
+    ):
+        # The instances are only pulled when a slot is free, so an `iter_fetch` is never read ahead
+        semaphore = asyncio.Semaphore(concurrency or settings.db_concurrency_limit)
+        result = BulkResult()
+        pending = set()
+
+        async def delete(instance: "DetaBase"):
+            try:
+                await instance.delete()
+                result.processed += 1
+            except Exception as e:
+                result.failed[str(instance.id)] = str(e) or e.__class__.__name__
+            finally:
+                semaphore.release()
+
+        async def iterate():
+            if isinstance(instances, AsyncIterable):
+                async for instance in instances:
+                    yield instance
+            else:
+                for instance in instances:
+                    yield instance
+
+        async for instance in iterate():
+            await semaphore.acquire()
+            task = asyncio.ensure_future(delete(instance))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+
+        await asyncio.gather(*pending)
+        return result
 
     @classmethod
     async def find(cls, _id: Union[UUID, str], exception=NotFoundHTTPException()):
+        if cls.cached:
+            instance = cls.cache().get(str(_id))
+            if instance is not None:
+                return cls.from_db(instance)
+
         async with async_client(cls.db_name) as db:
             instance = await db.get(str(_id))
+            if instance and cls.cached:
+                cls.cache().set(str(_id), instance)
             if instance is None and exception:
                 raise exception
             elif instance:
-                return cls(**instance)
+                return cls.from_db(instance)
             else:
                 return None
 
     @classmethod
-    async def fetch(cls, query, limit: int = inf):
+    async def find_many(cls, ids: Iterable[Union[UUID, str]]):
+        keys = {str(_id) for _id in ids}
+        found = {}
+
+        if cls.cached:
+            for key in keys:
+                instance = cls.cache().get(key)
+                if instance is not None:
+                    found[key] = cls.from_db(instance)
+
         async with async_client(cls.db_name) as db:
-            query = jsonable_encoder(query)
-            res = await db.fetch(query, limit=min(limit, settings.max_page_limit))
-            all_items = res.items
+            instances = await gather_bounded(db.get(key) for key in keys.difference(found))
 
-            while len(all_items) <= limit and res.last:
-                res = await db.fetch(query, last=res.last)
-                all_items += res.items
+        for instance in instances:
+            if instance:
+                if cls.cached:
+                    cls.cache().set(instance["key"], instance)
+                found[instance["key"]] = cls.from_db(instance)
+
+        return found
 
-            return [cls(**instance) for instance in all_items]
+    @classmethod
+    async def iter_fetch(cls, query, limit: int = inf, page_size: int = FETCH_LIMIT):
+        """Yields the matching rows while fetching them one page at a time, stopping after `limit` rows"""
+        async with async_client(cls.db_name) as db:
+            async for instance in iter_items(db, jsonable_encoder(query), limit, page_size):
+                yield cls.from_db(instance)
+
+    @classmethod
+    async def fetch(cls, query, limit: int = inf):
+        return [instance async for instance in cls.iter_fetch(query, limit)]
+
+    @classmethod
+    async def pagination(
+        cls,
+        index,
+        query,
+        limit: int,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        partition: Optional[str] = None,
+    ):
+        await index.ensure_built(cls)
+        page_request = index.page(query, limit, offset, cursor, partition)
+
+        if query:
+            # The counters only know about the whole partition, so filtered totals are estimated
+            (entries, skipped, next_cursor), count = await page_request, None
+        else:
+            (entries, skipped, next_cursor), count = await asyncio.gather(page_request, index.count(partition))
+
+        page = cls._from_entries(entries)
+        if count is None:
+            count = skipped + len(page) + (1 if next_cursor else 0)
+        return count, page, next_cursor
+
+    @classmethod
+    async def pagination_of(
+        cls,
+        name: str,
+        ids: list[str],
+        limit: int,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ):
+        """Same as `pagination`, over the ids of results already ranked in memory"""
+        position = decode_position(name, cursor)
+        if position is not None:
+            offset = position
+
+        window = ids[offset:][:limit]
+        found = await cls.find_many(window)
+        page = [found[_id] for _id in window if _id in found]
+
+        next_cursor = encode_cursor(name, str(offset + limit)) if offset + limit < len(ids) else None
+        return len(ids), page, next_cursor
+
+    @classmethod
+    async def fetch_sorted(cls, index, query=None, partition: Optional[str] = None):
+        await index.ensure_built(cls)
+        return cls._from_entries(await index.entries(query, partition))
 
     @classmethod
-    async def pagination(cls, query, limit: int, offset: int, order_by: Callable[["DetaBase"], str], reverse=False):
-        if query is None:
-            query = dict()
-        results = await cls.fetch(query, limit + offset + 5)
-        count = len(results)
-        top = limit + offset
-        page = sorted(results, key=order_by, reverse=reverse)[offset:top]
-        return count, page
+    def _from_entries(cls, entries: list[dict]):
+        instances = []
+        for entry in entries:
+            # The entries are copies of the rows, only keyed differently
+            instance = {**entry, "key": entry["id"]}
+            if cls.cached:
+                cls.cache().set(instance["key"], instance)
+            instances.append(cls.from_db(instance))
+        return instances
@@ -1,20 +1,115 @@
-from datetime import datetime
-from typing import ClassVar, Optional, Union
+import asyncio
+from bisect import bisect_left, insort
+from collections import Counter
+from datetime import datetime, timedelta
+from enum import Enum
+from time import monotonic
+from typing import ClassVar, Iterable, Optional, Union
 from uuid import UUID
 
 from pydantic import Field
 
 from ..exceptions import NotFoundHTTPException
 from ..fastapi_permissions import Allow, Everyone
-from .base import DetaBase
+from .base import DetaBase, settings
+from .counter import get_count, increment
+from .index import LoopLock, SortedIndex, descending_number, descending_time
+from .loader import loader
 from .manga import Manga
 
+# The chapters referencing each stored page are counted in `page_refs:<hash>`, with the time of the last release
+PAGE_REFS = "page_refs:"
+
+# The pages of a commit in progress that are already stored are counted in `stored_pages:<chapter id>`, along
+# with the time it started and the hashes of its pages
+STORED_PAGES = "stored_pages:"
+
+# Time after which a commit still in progress is considered interrupted, the cron marks its chapter as failed
+COMMIT_TIMEOUT = timedelta(hours=1)
+
+# Time a page stays stored once no chapter references it, as a commit may be storing it again. It must be longer
+# than the interval of the cron, which fixes the counts lowered by a lost or repeated release before they're used
+PAGE_COLLECT_DELAY = timedelta(days=1)
+
+
+class ChapterStatus(str, Enum):
+    processing = "processing"
+    ready = "ready"
+    failed = "failed"
+
 
 class ScanGroup(DetaBase):
     id: str
     db_name: ClassVar = "scan_groups"
 
 
+class ScanGroupRegistry:
+    """In-memory copy of the known scan groups, sorted for prefix lookups and reloaded after `ttl` seconds"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.expiry = 0.0
+        self.lock = LoopLock()
+        self.entries: list[tuple[str, str]] = []
+        self.names: set[str] = set()
+
+    async def load(self):
+        if monotonic() < self.expiry:
+            return
+
+        async with self.lock():
+            if monotonic() < self.expiry:
+                return
+            names = {group.id async for group in ScanGroup.iter_fetch({})}
+            self.entries = sorted((name.casefold(), name) for name in names)
+            self.names = names
+            self.expiry = monotonic() + self.ttl
+
+    async def add(self, name: str):
+        await self.load()
+        if name in self.names:
+            return
+
+        await ScanGroup(id=name).save()
+        if name not in self.names:
+            self.names.add(name)
+            insort(self.entries, (name.casefold(), name))
+
+    async def search(self, prefix: str = "") -> list[str]:
+        """Returns the groups starting with the prefix, ignoring the case"""
+        await self.load()
+
+        prefix = prefix.casefold()
+        start = bisect_left(self.entries, (prefix,))
+        end = bisect_left(self.entries, (prefix + chr(0x10FFFF),))
+        return [name for _, name in self.entries[start:end]]
+
+
+scan_groups = ScanGroupRegistry(settings.scan_groups_ttl)
+
+
+async def _count_pages(pages: Iterable[str], sign: int, **fields):
+    counts = Counter(pages).items()
+    await asyncio.gather(*(increment(f"{PAGE_REFS}{page}", sign * count, **fields) for page, count in counts))
+
+
+async def retain_pages(pages: Iterable[str]):
+    await _count_pages(pages, 1)
+
+
+async def release_pages(pages: Iterable[str]):
+    """Drops the references to the pages, the ones no chapter references anymore are removed by the cron"""
+    await _count_pages(pages, -1, released=datetime.now().isoformat())
+
+
+by_upload_time = SortedIndex("chapters_by_upload_time", lambda chapter: descending_time(chapter.upload_time))
+by_manga = SortedIndex(
+    "chapters_by_manga",
+    lambda chapter: descending_number(chapter.number),
+    lambda chapter: chapter.manga_id,
+)
+
+
 class Chapter(DetaBase):
     owner_id: Optional[UUID]
     name: str
@@ -25,7 +120,15 @@ class Chapter(DetaBase):
     webtoon: bool = False
     upload_time: datetime = Field(default_factory=datetime.now)
     manga_id: UUID
+    status: ChapterStatus = ChapterStatus.ready
+    # Hashes of the pages in order, the chapters uploaded before they were stored by hash don't have any
+    pages: list[str] = []
+    # Numbers of the pages the last commit couldn't store, in the order they were committed
+    failed_pages: list[int] = []
     db_name: ClassVar = "chapters"
+    cached: ClassVar = True
+    trusted: ClassVar = True
+    indexes: ClassVar = (by_upload_time, by_manga)
 
     @property
     def __acl__(self):
@@ -42,40 +145,43 @@ class Chapter(DetaBase):
         )
 
     async def save(self):
-        await ScanGroup(id=self.scan_group).save()
+        await scan_groups.add(self.scan_group)
         await super().save()
 
+    async def update(self, **kwargs):
+        if "scan_group" in kwargs:
+            await scan_groups.add(kwargs["scan_group"])
+        await super().update(**kwargs)
+
     async def delete(self):
         from .comment import Comment
 
-        chapters = await Comment.fetch({"chapter_id": str(self.id)})
-
-        await DetaBase.delete_many(chapters)
+        comments = Comment.iter_fetch({"chapter_id": str(self.id)})
+        result = await DetaBase.delete_many(comments)
+        result.raise_for_failures("Some comments of the chapter couldn't be deleted")
         await super().delete()
+        await release_pages(self.pages)
+
+    async def progress(self) -> Optional[int]:
+        """Amount of pages of the commit in progress that are already stored"""
+        if self.status != ChapterStatus.processing:
+            return None
+        return await get_count(f"{STORED_PAGES}{self.id}")
 
     @classmethod
-    async def latest(cls, limit: int = 20, offset: int = 0):
-        count, results = await cls.pagination({}, limit, offset, lambda x: x.upload_time, True)
+    async def latest(cls, limit: int = 20, offset: int = 0, cursor: Optional[str] = None):
+        count, results, next_cursor = await cls.pagination(by_upload_time, {}, limit, offset, cursor)
 
         dict_results = [result.dict() for result in results]
+        mangas = await loader(Manga).load_many(result["manga_id"] for result in dict_results)
 
-        cache = {}
-        for result in dict_results:
-            if result["manga_id"] not in cache:
-                cache[result["manga_id"]] = await Manga.find(result["manga_id"])
-            result["manga"] = cache[result["manga_id"]]
-        return count, dict_results
+        for result, manga in zip(dict_results, mangas):
+            result["manga"] = manga
+        return count, dict_results, next_cursor
 
     @classmethod
     async def from_manga(cls, manga_id: UUID):
-        query = {"manga_id": str(manga_id)}
-        results = await cls.fetch(query)
-        return sorted(results, key=lambda x: x.number, reverse=True)
-
-    @classmethod
-    async def get_groups(cls):
-        groups = await ScanGroup.fetch({})
-        return [group.id for group in groups]
+        return await cls.fetch_sorted(by_manga, partition=str(manga_id))
 
 
 class DetailedChapter(Chapter):
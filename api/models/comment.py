@@ -6,8 +6,16 @@ from pydantic import Field
 
 from ..fastapi_permissions import Allow, Authenticated, Everyone
 from .base import DetaBase
+from .index import SortedIndex, ascending_time
+from .loader import loader
 from .user import User
 
+by_chapter = SortedIndex(
+    "comments_by_chapter",
+    lambda comment: ascending_time(comment.create_time),
+    lambda comment: comment.chapter_id,
+)
+
 
 class Comment(DetaBase):
     author_id: UUID
@@ -16,6 +24,8 @@ class Comment(DetaBase):
     reply_to: Optional[UUID]
     create_time: datetime = Field(default_factory=datetime.now)
     db_name: ClassVar = "comment"
+    trusted: ClassVar = True
+    indexes: ClassVar = (by_chapter,)
 
     @property
     def __acl__(self):
@@ -38,10 +48,10 @@ class DetailedComment(Comment):
     author: User
 
     @classmethod
-    async def from_chapter(cls, chapter_id: UUID, limit: int = 20, offset: int = 0):
-        query = {"chapter_id": str(chapter_id)}
-        count, page = await Comment.pagination(query, limit, offset, lambda x: getattr(x, "create_time"))
+    async def from_chapter(cls, chapter_id: UUID, limit: int = 20, offset: int = 0, cursor: Optional[str] = None):
+        count, page, next_cursor = await Comment.pagination(by_chapter, {}, limit, offset, cursor, str(chapter_id))
 
-        page = [cls(**comment.dict(), author=await User.find(comment.author_id)) for comment in page]
+        authors = await loader(User).load_many(comment.author_id for comment in page)
+        page = [cls(**comment.dict(), author=author) for comment, author in zip(page, authors)]
 
-        return count, page
+        return count, page, next_cursor
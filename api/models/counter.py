@@ -0,0 +1,59 @@
+from typing import Optional
+
+from aiohttp import ClientResponseError
+
+from .base import async_client, delete_all, iter_items, put_all
+
+COUNTERS_DB = "counters"
+
+
+async def increment(key: str, amount: int = 1, **fields):
+    """Adds the amount to the counter, the `fields` are written along with it"""
+    async with async_client(COUNTERS_DB) as db:
+        try:
+            await db.update({"value": db.util.increment(amount), **fields}, key)
+        except ClientResponseError as e:
+            if e.status != 404:
+                raise
+            # First count of this key, unless another request created it in the meantime
+            try:
+                await db.insert({"value": amount, **fields}, key)
+            except ClientResponseError as e:
+                if e.status != 409:
+                    raise
+                await db.update({"value": db.util.increment(amount), **fields}, key)
+
+
+async def get_count(key: str) -> Optional[int]:
+    async with async_client(COUNTERS_DB) as db:
+        counter = await db.get(key)
+    return counter["value"] if counter else None
+
+
+async def get_counters(prefix: str, query: Optional[dict] = None) -> list[dict]:
+    """The counters starting with the prefix and matching the query, with their fields"""
+    async with async_client(COUNTERS_DB) as db:
+        return [counter async for counter in iter_items(db, {"key?pfx": prefix, **(query or {})})]
+
+
+async def get_counts(prefix: str) -> dict[str, int]:
+    return {counter["key"]: counter["value"] for counter in await get_counters(prefix)}
+
+
+async def set_count(key: str, value: int, **fields):
+    async with async_client(COUNTERS_DB) as db:
+        await db.put({"value": value, **fields}, key)
+
+
+async def delete_count(key: str):
+    async with async_client(COUNTERS_DB) as db:
+        await db.delete(key)
+
+
+async def set_counts(prefix: str, counts: dict[str, int]):
+    """Overwrites the counters starting with the prefix, the ones missing from `counts` are dropped"""
+    existing = await get_counts(prefix)
+
+    async with async_client(COUNTERS_DB) as db:
+        await put_all(db, ({"key": key, "value": value} for key, value in counts.items()))
+        await delete_all(db, (key for key in existing if key not in counts))
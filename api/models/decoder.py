@@ -0,0 +1,92 @@
+from datetime import datetime
+from enum import Enum
+from functools import cache
+from typing import Callable, Optional, Type
+from uuid import UUID
+
+from pydantic import BaseModel
+from pydantic.fields import SHAPE_LIST, ModelField
+
+# Rows that can't be decoded by the trusted path (missing or malformed values) are validated instead
+DecodeError = (KeyError, TypeError, ValueError)
+
+
+def _instance_of(type_: type):
+    def convert(value):
+        if not isinstance(value, type_):
+            raise TypeError(f"Expected {type_.__name__}")
+        return value
+
+    return convert
+
+
+def _list_of(convert: Callable):
+    def convert_list(value):
+        if not isinstance(value, list):
+            raise TypeError("Expected list")
+        return [convert(item) for item in value]
+
+    return convert_list
+
+
+def _converter(type_) -> Optional[Callable]:
+    if not isinstance(type_, type):
+        return None
+    if issubclass(type_, Enum):
+        return type_
+    if issubclass(type_, bool):
+        return _instance_of(bool)
+    if issubclass(type_, str):
+        # Also covers the constrained strings like EmailStr, which are stored already validated
+        return _instance_of(str)
+    if issubclass(type_, UUID):
+        return UUID
+    if issubclass(type_, datetime):
+        return datetime.fromisoformat
+    if issubclass(type_, int):
+        return int
+    if issubclass(type_, float):
+        return float
+    return None
+
+
+def _field_converter(field: ModelField) -> Optional[Callable]:
+    if field.class_validators:
+        return None
+    if field.shape == SHAPE_LIST:
+        # Lists of the supported values, like the hashes of the pages of a chapter
+        item = field.sub_fields[0]
+        convert = None if item.sub_fields or item.class_validators else _converter(item.type_)
+        return convert and _list_of(convert)
+    if field.sub_fields:
+        return None
+    return _converter(field.type_)
+
+
+@cache
+def compile_decoder(model: Type[BaseModel]) -> Optional[Callable[[dict], BaseModel]]:
+    """Builds a function hydrating the model from a row without validation, if all its fields are supported"""
+    fields = []
+    for name, field in model.__fields__.items():
+        convert = _field_converter(field)
+        if convert is None:
+            return None
+        fields.append((name, field.alias, convert, field.allow_none, field.required))
+
+    def decode(row: dict):
+        values = {}
+        for name, alias, convert, allow_none, required in fields:
+            if alias not in row:
+                if required:
+                    raise KeyError(alias)
+                continue
+            value = row[alias]
+            if value is None:
+                if not allow_none:
+                    raise TypeError(f"{alias} can't be null")
+                values[name] = None
+            else:
+                values[name] = convert(value)
+        return model.construct(_fields_set=set(values), **values)
+
+    return decode
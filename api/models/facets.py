@@ -0,0 +1,137 @@
+import asyncio
+from collections import Counter, defaultdict
+from time import monotonic
+from typing import Any, Callable, Iterable
+
+from fastapi.encoders import jsonable_encoder
+
+from .base import DetaBase, async_client, settings
+from .counter import get_count, get_counts, increment, set_counts
+from .index import Index, LoopLock, decode_value, delete_existing, encode_value, insert_or_put
+
+
+class FacetIndex(Index):
+    """Records of the rows of a model for each value of its facets, keyed `facet:value#id`
+
+    The records hold the facets and the `fields` of the row, so the rows matching a filter can be sorted
+    and counted without loading them. The amount of rows of each facet value is kept in the counters, which
+    are read at most once every `facet_counts_ttl` seconds for the unfiltered listings.
+    """
+
+    def __init__(self, name: str, facets: Iterable[str], fields: Callable[[DetaBase], dict]):
+        super().__init__(name, f"facets_{name}")
+        self.facets = tuple(facets)
+        self.fields = fields
+        self.counts_lock = LoopLock()
+        self.counts_expiry = 0.0
+        self.cached_counts: dict[str, dict[str, int]] = {}
+
+    def record(self, instance: DetaBase):
+        return {**jsonable_encoder(self.fields(instance)), "id": str(instance.id)}
+
+    def value_key(self, facet: str, value: Any):
+        return f"{facet}:{encode_value(value)}"
+
+    def entries(self, instance: DetaBase):
+        record = self.record(instance)
+        return {
+            f"{self.value_key(facet, record[facet])}#{instance.id}": record
+            for facet in self.facets
+            if record.get(facet) is not None
+        }
+
+    def counter_key(self, key: str):
+        return f"{self.name}:{key.split('#', 1)[0]}"
+
+    async def _write(self, db, key: str, record: dict, count: bool):
+        inserted = await insert_or_put(db, {**record, "key": key})
+        if inserted and count:
+            await increment(self.counter_key(key))
+            self.counts_expiry = 0.0
+
+    async def _delete(self, db, key: str):
+        if await delete_existing(db, key):
+            await increment(self.counter_key(key), -1)
+            self.counts_expiry = 0.0
+
+    async def put(self, instance: DetaBase):
+        entries = self.entries(instance)
+        async with async_client(self.db_name) as db:
+            await asyncio.gather(*(self._write(db, key, record, True) for key, record in entries.items()))
+
+    def entry_keys(self, instance: DetaBase):
+        return self.entries(instance).keys()
+
+    async def put_many(self, instances: Iterable[DetaBase]):
+        """Writes the records without counting them, the rebuild recounts them once they're all written"""
+        await self.put_entries(
+            {**record, "key": key} for instance in instances for key, record in self.entries(instance).items()
+        )
+
+    async def replace(self, old: DetaBase, new: DetaBase):
+        old_entries, new_entries = self.entries(old), self.entries(new)
+        if old_entries == new_entries:
+            return
+
+        async with async_client(self.db_name) as db:
+            await asyncio.gather(
+                *(self._write(db, key, record, key not in old_entries) for key, record in new_entries.items()),
+                *(self._delete(db, key) for key in old_entries if key not in new_entries),
+            )
+
+    async def delete(self, instance: DetaBase):
+        async with async_client(self.db_name) as db:
+            await asyncio.gather(*(self._delete(db, key) for key in self.entries(instance)))
+
+    async def reconcile(self):
+        counts = Counter()
+        async for entry in self.iter_entries():
+            counts[self.counter_key(entry["key"])] += 1
+
+        await set_counts(f"{self.name}:", counts)
+
+    async def counts(self, model: type[DetaBase]) -> dict[str, dict[str, int]]:
+        """Amount of rows of each value of the facets, across the whole collection"""
+        await self.ensure_built(model)
+        if monotonic() < self.counts_expiry:
+            return self.cached_counts
+
+        async with self.counts_lock():
+            if monotonic() < self.counts_expiry:
+                return self.cached_counts
+
+            counts = {facet: {} for facet in self.facets}
+            for key, count in (await get_counts(f"{self.name}:")).items():
+                facet, value = key.removeprefix(f"{self.name}:").split(":", 1)
+                if count > 0 and facet in counts:
+                    counts[facet][decode_value(value)] = count
+            self.cached_counts = counts
+            self.counts_expiry = monotonic() + settings.facet_counts_ttl
+        return counts
+
+    def count_records(self, records: Iterable[dict]) -> dict[str, dict[str, int]]:
+        counts = {facet: defaultdict(int) for facet in self.facets}
+        for record in records:
+            for facet in self.facets:
+                if record.get(facet) is not None:
+                    counts[facet][str(record[facet])] += 1
+        return {facet: dict(values) for facet, values in counts.items()}
+
+    def matches(self, record: dict, filters: dict):
+        return all(record.get(facet) == value for facet, value in jsonable_encoder(filters).items())
+
+    async def filter(self, model: type[DetaBase], filters: dict):
+        """Returns the records of the rows matching all the filters
+
+        Only the records of the least common value are fetched, the other filters are checked on them.
+        """
+        await self.ensure_built(model)
+
+        filters = jsonable_encoder(filters)
+        keys = [self.value_key(facet, value) for facet, value in filters.items()]
+        counts = await asyncio.gather(*(get_count(f"{self.name}:{key}") for key in keys))
+        if any(not count for count in counts):
+            return []
+
+        key = min(zip(counts, keys))[1]
+        return [entry async for entry in self.iter_entries({"key?pfx": f"{key}#"}) if self.matches(entry, filters)]
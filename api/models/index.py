@@ -0,0 +1,274 @@
+import asyncio
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Iterable, Optional
+
+from aiohttp import ClientResponseError
+from fastapi.encoders import jsonable_encoder
+
+from .base import FETCH_LIMIT, DetaBase, async_client, delete_all, iter_items, put_all
+from .counter import get_count, increment, set_counts
+from .pagination import decode_cursor, encode_cursor
+
+# Base keeping track of the indexes that have already been built
+INDEX_META_DB = "indexes"
+
+# Numbers are stored as fixed-point with 3 decimals, shifted so that negative numbers keep their order
+NUMBER_PRECISION = 1000
+NUMBER_OFFSET = 10**14
+
+_inverted_digits = str.maketrans("0123456789", "9876543210")
+
+
+def ascending_time(value: datetime) -> str:
+    return value.strftime("%Y%m%d%H%M%S%f")
+
+
+def descending_time(value: datetime) -> str:
+    return ascending_time(value).translate(_inverted_digits)
+
+
+def ascending_number(value: float) -> str:
+    return f"{round(value * NUMBER_PRECISION) + NUMBER_OFFSET:015d}"
+
+
+def descending_number(value: float) -> str:
+    return ascending_number(value).translate(_inverted_digits)
+
+
+def encode_value(value: Any) -> str:
+    """Encodes a value to be part of a key, as it could hold characters that aren't allowed in keys"""
+    return urlsafe_b64encode(str(value).encode()).decode().rstrip("=")
+
+
+def decode_value(value: str) -> str:
+    return urlsafe_b64decode(value + "=" * (-len(value) % 4)).decode()
+
+
+async def insert_or_put(db, entry: dict):
+    """Writes the entry, telling if it didn't exist before"""
+    try:
+        await db.insert(entry)
+        return True
+    except ClientResponseError as e:
+        if e.status != 409:
+            raise
+        await db.put(entry)
+        return False
+
+
+async def delete_existing(db, key: str):
+    """Deletes the entry, telling if it existed"""
+    if not await db.get(key):
+        return False
+    await db.delete(key)
+    return True
+
+
+class LoopLock:
+    """Lock made in the running loop when it's first used, as the indexes are created at import time"""
+
+    def __init__(self):
+        self.loop = None
+        self.lock = None
+
+    def __call__(self) -> asyncio.Lock:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop, self.lock = loop, asyncio.Lock()
+        return self.lock
+
+
+class Index:
+    """Records derived from the rows of a model, kept in their own Base and built the first time they're used"""
+
+    def __init__(self, name: str, db_name: str):
+        self.name = name
+        self.db_name = db_name
+        self.built = False
+        self.lock = LoopLock()
+
+    async def ensure_built(self, model: type[DetaBase]):
+        """Builds the index if it was never built, the concurrent requests wait for a single build"""
+        if self.built:
+            return
+
+        async with self.lock():
+            if self.built:
+                return
+
+            async with async_client(INDEX_META_DB) as db:
+                built = await db.get(self.name)
+
+            if not built:
+                await self.rebuild(model)
+            self.built = True
+
+    async def mark_built(self):
+        async with async_client(INDEX_META_DB) as db:
+            await db.put({"key": self.name, "build_time": datetime.now().isoformat()})
+
+    def entry_keys(self, instance: DetaBase) -> Iterable[str]:
+        raise NotImplementedError
+
+    async def put_many(self, instances: Iterable[DetaBase]):
+        raise NotImplementedError
+
+    async def iter_entries(self, query=None):
+        async with async_client(self.db_name) as db:
+            async for entry in iter_items(db, query or {}):
+                yield entry
+
+    async def put_entries(self, entries: Iterable[dict]):
+        async with async_client(self.db_name) as db:
+            await put_all(db, entries)
+
+    async def delete_entries(self, keys: Iterable[str]):
+        async with async_client(self.db_name) as db:
+            await delete_all(db, keys)
+
+    async def rebuild(self, model: type[DetaBase]):
+        """Writes the entries of all the rows of the model, and drops the ones that don't match a row anymore"""
+        expected = set()
+        instances = []
+        async for instance in model.iter_fetch({}):
+            expected.update(self.entry_keys(instance))
+            instances.append(instance)
+            if len(instances) == FETCH_LIMIT:
+                await self.put_many(instances)
+                instances = []
+        await self.put_many(instances)
+
+        await self.delete_entries(
+            [entry["key"] async for entry in self.iter_entries() if entry["key"] not in expected]
+        )
+        await self.reconcile()
+        await self.mark_built()
+
+    async def reconcile(self):
+        pass
+
+
+class SortedIndex(Index):
+    """Copies of the rows of a model, keyed so that Deta returns them in the order of the index
+
+    The keys are `[partition#]sort_key#id`, so a page is a single fetch resuming from the last key seen.
+    The amount of entries of each partition is kept in the counters, so totals don't need a scan.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        sort_key: Callable[[DetaBase], str],
+        partition: Optional[Callable[[DetaBase], str]] = None,
+    ):
+        super().__init__(name, f"index_{name}")
+        self.sort_key = sort_key
+        self.partition = partition
+
+    def key(self, instance: DetaBase):
+        parts = [self.sort_key(instance), str(instance.id)]
+        if self.partition:
+            parts.insert(0, str(self.partition(instance)))
+        return "#".join(parts)
+
+    def entry(self, instance: DetaBase):
+        return {**jsonable_encoder(instance), "key": self.key(instance)}
+
+    def counter_key(self, partition: Optional[str] = None):
+        return f"{self.name}:{partition}" if partition is not None else self.name
+
+    def _partition_of(self, instance: DetaBase):
+        return str(self.partition(instance)) if self.partition else None
+
+    async def count(self, partition: Optional[str] = None):
+        return await get_count(self.counter_key(partition))
+
+    async def put(self, instance: DetaBase):
+        async with async_client(self.db_name) as db:
+            inserted = await insert_or_put(db, self.entry(instance))
+
+        # A row that was already indexed is only updated, and not counted again
+        if inserted:
+            await increment(self.counter_key(self._partition_of(instance)))
+
+    def entry_keys(self, instance: DetaBase):
+        return (self.key(instance),)
+
+    async def put_many(self, instances: Iterable[DetaBase]):
+        """Writes the entries without counting them, the rebuild recounts them once they're all written"""
+        await self.put_entries(self.entry(instance) for instance in instances)
+
+    async def replace(self, old: DetaBase, new: DetaBase):
+        async with async_client(self.db_name) as db:
+            await db.put(self.entry(new))
+            if self.key(old) != self.key(new):
+                await db.delete(self.key(old))
+
+        old_partition, new_partition = self._partition_of(old), self._partition_of(new)
+        if old_partition != new_partition:
+            await asyncio.gather(
+                increment(self.counter_key(old_partition), -1),
+                increment(self.counter_key(new_partition)),
+            )
+
+    async def delete(self, instance: DetaBase):
+        async with async_client(self.db_name) as db:
+            deleted = await delete_existing(db, self.key(instance))
+
+        if deleted:
+            await increment(self.counter_key(self._partition_of(instance)), -1)
+
+    async def reconcile(self):
+        """Recounts the entries of every partition, fixing the counters that drifted"""
+        counts = Counter({} if self.partition else {self.name: 0})
+        async for entry in self.iter_entries():
+            counts[self.counter_key(entry["key"].split("#", 1)[0] if self.partition else None)] += 1
+
+        await set_counts(f"{self.name}:" if self.partition else self.name, counts)
+
+    def _query(self, query, partition: Optional[str]):
+        query = jsonable_encoder(query or {})
+        if partition is None:
+            return query
+
+        prefix = {"key?pfx": f"{partition}#"}
+        return [{**q, **prefix} for q in query] if isinstance(query, list) else {**query, **prefix}
+
+    async def iter_entries(self, query=None, partition: Optional[str] = None):
+        """Yields the matching entries in the order of the index, fetching them one page at a time"""
+        async for entry in super().iter_entries(self._query(query, partition)):
+            yield entry
+
+    async def entries(self, query=None, partition: Optional[str] = None):
+        """Fetches all the matching entries, already in the order of the index"""
+        return [entry async for entry in self.iter_entries(query, partition)]
+
+    async def page(
+        self,
+        query,
+        limit: int,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+        partition: Optional[str] = None,
+    ):
+        """Fetches a page of entries, returning them with the amount of skipped entries and the next cursor
+
+        The offset is skipped from the cursor's position, one bounded fetch at a time.
+        """
+        query = self._query(query, partition)
+        last = decode_cursor(self.name, cursor)
+        skipped = 0
+
+        async with async_client(self.db_name) as db:
+            while skipped < offset:
+                res = await db.fetch(query, limit=min(offset - skipped, FETCH_LIMIT), last=last)
+                skipped += len(res.items)
+                last = res.last
+                if not last:
+                    return [], skipped, None
+
+            res = await db.fetch(query, limit=limit, last=last)
+
+        return res.items, skipped, encode_cursor(self.name, res.last) if res.last else None
@@ -0,0 +1,75 @@
+import asyncio
+from contextvars import ContextVar
+from typing import Iterable, Optional, Type, Union
+from uuid import UUID
+
+from ..exceptions import NotFoundHTTPException
+from .base import DetaBase
+
+request_loaders: ContextVar[Optional[dict]] = ContextVar("request_loaders", default=None)
+
+
+class Loader:
+    """Coalesces the lookups issued during the same event loop tick into a single `find_many`"""
+
+    def __init__(self, model: Type[DetaBase]):
+        self.model = model
+        self.futures: dict[str, asyncio.Future] = {}
+        self.queue: list[str] = []
+
+    async def load(self, _id: Union[UUID, str], exception=NotFoundHTTPException()):
+        instance = await self._future(str(_id))
+        if instance is None and exception:
+            raise exception
+        return instance
+
+    async def load_many(self, ids: Iterable[Union[UUID, str]], exception=NotFoundHTTPException()):
+        return await asyncio.gather(*(self.load(_id, exception) for _id in ids))
+
+    def _future(self, key: str):
+        if key not in self.futures:
+            loop = asyncio.get_running_loop()
+            if not self.queue:
+                loop.call_soon(lambda: asyncio.ensure_future(self._dispatch()))
+            self.futures[key] = loop.create_future()
+            self.queue.append(key)
+        return self.futures[key]
+
+    async def _dispatch(self):
+        keys, self.queue = self.queue, []
+        try:
+            found = await self.model.find_many(keys)
+        except Exception as e:
+            for key in keys:
+                self.futures.pop(key).set_exception(e)
+            return
+
+        for key in keys:
+            self.futures[key].set_result(found.get(key))
+
+
+def loader(model: Type[DetaBase]) -> Loader:
+    """Provides the loader of a model for the current request, or a standalone one outside of requests"""
+    loaders = request_loaders.get()
+    if loaders is None:
+        return Loader(model)
+    if model not in loaders:
+        loaders[model] = Loader(model)
+    return loaders[model]
+
+
+class LoaderMiddleware:
+    """Gives each request its own set of loaders, so results are only shared within a request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        token = request_loaders.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_loaders.reset(token)
@@ -0,0 +1,87 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, Callable, Iterable, Optional
+
+from aiohttp import ClientResponseError
+from fastapi import HTTPException
+
+from .base import DetaBase, async_client
+from .index import Index, encode_value
+
+# Time after which a value held by a row that doesn't exist is considered abandoned, its write having failed
+CLAIM_TIMEOUT = timedelta(minutes=1)
+
+
+class UniqueIndex(Index):
+    """Records keyed `field:value`, pointing to the id of the row holding that value
+
+    A row claims its values before being written, the first one to insert a value owns it, so two rows
+    can't end up with the same value even when they are written at the same time.
+    """
+
+    def __init__(self, name: str, fields: dict[str, Callable[[DetaBase], Any]], exception: HTTPException):
+        super().__init__(name, f"lookup_{name}")
+        self.fields = fields
+        self.exception = exception
+
+    def key(self, field: str, value: Any):
+        return f"{field}:{encode_value(value)}"
+
+    def keys(self, instance: DetaBase):
+        values = {field: value(instance) for field, value in self.fields.items()}
+        return {self.key(field, value) for field, value in values.items() if value is not None}
+
+    async def get(self, model: type[DetaBase], field: str, value: Any) -> Optional[str]:
+        """Returns the id of the row holding the value"""
+        await self.ensure_built(model)
+
+        async with async_client(self.db_name) as db:
+            lookup = await db.get(self.key(field, value))
+        return lookup["id"] if lookup else None
+
+    async def claim(self, instance: DetaBase, owned: Iterable[str] = ()):
+        """Claims the values of the instance, raising the exception if one of them is held by another row"""
+        await self.ensure_built(instance.__class__)
+        keys = self.keys(instance).difference(owned)
+        claimed = []
+
+        def abandoned(lookup: dict):
+            claim_time = datetime.fromisoformat(lookup.get("claim_time", datetime.min.isoformat()))
+            return datetime.now() - claim_time > CLAIM_TIMEOUT
+
+        async def claim(db, key: str):
+            lookup = {"key": key, "id": str(instance.id), "claim_time": datetime.now().isoformat()}
+            try:
+                await db.insert(lookup)
+            except ClientResponseError as e:
+                if e.status != 409:
+                    raise
+                current = await db.get(key)
+                # The value can be taken back from a row whose write failed, but not from one being written
+                if current and current["id"] != str(instance.id):
+                    if not abandoned(current) or await instance.__class__.find(current["id"], None):
+                        return False
+                await db.put(lookup)
+                if current and current["id"] == str(instance.id):
+                    # The row already held the value, it keeps it if another one can't be claimed
+                    return True
+            claimed.append(key)
+            return True
+
+        async with async_client(self.db_name) as db:
+            results = await asyncio.gather(*(claim(db, key) for key in keys))
+            if not all(results):
+                await asyncio.gather(*(db.delete(key) for key in claimed))
+                raise self.exception
+
+    async def release(self, instance: DetaBase, kept: Iterable[str] = ()):
+        async with async_client(self.db_name) as db:
+            await asyncio.gather(*(db.delete(key) for key in self.keys(instance).difference(kept)))
+
+    def entry_keys(self, instance: DetaBase):
+        return self.keys(instance)
+
+    async def put_many(self, instances: Iterable[DetaBase]):
+        await self.put_entries(
+            {"key": key, "id": str(instance.id)} for instance in instances for key in self.keys(instance)
+        )
@@ -1,10 +1,16 @@
+import asyncio
 from datetime import datetime
 from enum import Enum
-from typing import ClassVar, Optional
+from typing import ClassVar, Optional, Union
 from uuid import UUID
 
+from pydantic import BaseModel
+
 from ..fastapi_permissions import Allow, Everyone
 from .base import DetaBase, Field
+from .facets import FacetIndex
+from .index import SortedIndex, ascending_time, descending_number
+from .search import SearchIndex, normalize
 
 
 class Status(str, Enum):
@@ -14,6 +20,49 @@ class Status(str, Enum):
     cancelled = "cancelled"
 
 
+class Sort(str, Enum):
+    relevance = "relevance"
+    created = "created"
+    title = "title"
+    year = "year"
+
+
+def sortable_title(title: str):
+    return " ".join(normalize(title))[:200]
+
+
+def catalog_fields(manga: "Manga"):
+    return {
+        "create_time": manga.create_time,
+        "title": sortable_title(manga.title),
+        "year": manga.year,
+        "status": manga.status,
+        "author": manga.author,
+        "artist": manga.artist,
+    }
+
+
+by_create_time = SortedIndex("manga_by_create_time", lambda manga: ascending_time(manga.create_time))
+by_sortable_title = SortedIndex("manga_by_title", lambda manga: sortable_title(manga.title))
+# The manga without a year come last
+by_year = SortedIndex("manga_by_year", lambda manga: descending_number(manga.year) if manga.year else "~")
+by_title = SearchIndex("manga_titles", lambda manga: manga.title, catalog_fields)
+by_facets = FacetIndex("manga", ("status", "year", "author", "artist"), catalog_fields)
+
+sorted_indexes = {
+    Sort.relevance: by_create_time,
+    Sort.created: by_create_time,
+    Sort.title: by_sortable_title,
+    Sort.year: by_year,
+}
+record_sort_keys = {
+    Sort.relevance: None,
+    Sort.created: lambda record: record["create_time"],
+    Sort.title: lambda record: record["title"],
+    Sort.year: lambda record: -record["year"] if record["year"] else 1,
+}
+
+
 class Manga(DetaBase):
     owner_id: Optional[UUID]
     title: str
@@ -24,6 +73,9 @@ class Manga(DetaBase):
     year: Optional[int] = Field(ge=1900, le=2100)
     status: Status
     db_name: ClassVar = "manga"
+    cached: ClassVar = True
+    trusted: ClassVar = True
+    indexes: ClassVar = (by_create_time, by_sortable_title, by_year, by_title, by_facets)
 
     @property
     def __acl__(self):
@@ -44,15 +96,39 @@ class Manga(DetaBase):
     async def delete(self):
         from .chapter import Chapter
 
-        chapters = await Chapter.fetch({"manga_id": str(self.id)})
-
-        await DetaBase.delete_many(chapters)
+        chapters = Chapter.iter_fetch({"manga_id": str(self.id)})
+        result = await DetaBase.delete_many(chapters)
+        result.raise_for_failures("Some chapters of the manga couldn't be deleted")
         await super().delete()
 
     @classmethod
-    async def search(cls, title: str, limit: int = 20, offset: int = 0):
+    async def search(
+        cls,
+        title: str = "",
+        filters: Union[BaseModel, None] = None,
+        sort: Sort = Sort.relevance,
+        limit: int = 20,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ):
+        """Returns the page of the matching manga, along with the amount of matches for each facet value"""
+        filters = {k: v for k, v in filters.dict().items() if v is not None} if filters else {}
+
+        if not title and not filters:
+            (count, page, next_cursor), facets = await asyncio.gather(
+                cls.pagination(sorted_indexes[sort], {}, limit, offset, cursor),
+                by_facets.counts(cls),
+            )
+            return count, page, next_cursor, facets
+
         if title:
-            query = {"title?contains": title}
+            records = [record for record in await by_title.search(cls, title) if by_facets.matches(record, filters)]
         else:
-            query = {}
-        return await cls.pagination(query, limit, offset, lambda x: getattr(x, "create_time"))
+            records = sorted(await by_facets.filter(cls, filters), key=record_sort_keys[Sort.created])
+
+        if record_sort_keys[sort]:
+            records.sort(key=record_sort_keys[sort])
+
+        ids = [record["id"] for record in records]
+        count, page, next_cursor = await cls.pagination_of("manga_search", ids, limit, offset, cursor)
+        return count, page, next_cursor, by_facets.count_records(records)
@@ -0,0 +1,35 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as DecodeError
+from typing import Optional
+
+from ..exceptions import BadRequestHTTPException
+
+
+def encode_cursor(index: str, last: str) -> str:
+    content = json.dumps({"i": index, "l": last}, separators=(",", ":"))
+    return urlsafe_b64encode(content.encode()).decode().rstrip("=")
+
+
+def decode_cursor(index: str, cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+
+    try:
+        content = json.loads(urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if content["i"] == index and isinstance(content["l"], str):
+            return content["l"]
+    except (DecodeError, ValueError, TypeError, KeyError):
+        pass
+
+    raise BadRequestHTTPException("Invalid cursor")
+
+
+def decode_position(index: str, cursor: Optional[str]) -> Optional[int]:
+    """Decodes the cursors of the results ranked in memory, which hold the position of the next result"""
+    position = decode_cursor(index, cursor)
+    if position is None:
+        return None
+    if not position.isdigit():
+        raise BadRequestHTTPException("Invalid cursor")
+    return int(position)
@@ -0,0 +1,140 @@
+import asyncio
+import re
+import unicodedata
+from collections import Counter
+from math import inf
+from typing import Callable, Iterable, Optional
+
+from fastapi.encoders import jsonable_encoder
+
+from .base import DetaBase, gather_bounded
+from .counter import get_count, increment, set_counts
+from .index import Index
+
+# Words are padded so that the grams also tell where the words start and end
+PADDING = "_"
+
+_words = re.compile(r"[^\W_]+")
+
+
+def normalize(text: str) -> list[str]:
+    """Splits the text in case and accent insensitive words"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return _words.findall("".join(char for char in text if not unicodedata.combining(char)))
+
+
+def _trigrams(text: str):
+    return {"".join(gram) for gram in zip(text, text[1:], text[2:])}
+
+
+def trigrams(words: Iterable[str]) -> set[str]:
+    grams = set()
+    for word in words:
+        grams |= _trigrams(f"{PADDING * 2}{word}{PADDING}")
+    return grams
+
+
+def required_trigrams(words: Iterable[str]) -> set[str]:
+    """Grams every match contains: the ones inside of the longer words, or the start of the shorter ones"""
+    grams = set()
+    for word in words:
+        grams |= _trigrams(word) if len(word) >= 3 else _trigrams(f"{PADDING * 2}{word}")
+    return grams
+
+
+def matches(query: list[str], title: list[str]):
+    return all(any(term in word if len(term) >= 3 else word.startswith(term) for word in title) for term in query)
+
+
+def similarity(query: set[str], title: set[str]):
+    return len(query & title) / len(query | title)
+
+
+class SearchIndex(Index):
+    """Inverted trigram index of a text field of a model
+
+    There is an entry keyed `gram#id` for each trigram of the text, holding the normalized text so that
+    the candidates can be verified and ranked without loading the rows, along with the optional `fields`.
+    The amount of entries of each trigram is kept in the counters, so that a search only fetches the entries
+    of its rarest trigram.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        text: Callable[[DetaBase], str],
+        fields: Optional[Callable[[DetaBase], dict]] = None,
+    ):
+        super().__init__(name, f"search_{name}")
+        self.text = text
+        self.fields = fields
+
+    def entries(self, instance: DetaBase):
+        words = normalize(self.text(instance))
+        record = {**jsonable_encoder(self.fields(instance) if self.fields else {}), "id": str(instance.id)}
+        return [{**record, "key": f"{gram}#{instance.id}", "words": words} for gram in trigrams(words)]
+
+    def entry_keys(self, instance: DetaBase):
+        return (entry["key"] for entry in self.entries(instance))
+
+    def counter_key(self, key: str):
+        return f"{self.name}:{key.split('#', 1)[0]}"
+
+    async def _count(self, keys: Iterable[str], amount: int):
+        await gather_bounded(increment(self.counter_key(key), amount) for key in keys)
+
+    async def put(self, instance: DetaBase):
+        entries = self.entries(instance)
+        await asyncio.gather(self.put_entries(entries), self._count((entry["key"] for entry in entries), 1))
+
+    async def put_many(self, instances: Iterable[DetaBase]):
+        """Writes the entries without counting them, the rebuild recounts them once they're all written"""
+        await self.put_entries(entry for instance in instances for entry in self.entries(instance))
+
+    async def replace(self, old: DetaBase, new: DetaBase):
+        old_entries, new_entries = self.entries(old), self.entries(new)
+        if old_entries == new_entries:
+            return
+
+        old_keys, new_keys = {entry["key"] for entry in old_entries}, {entry["key"] for entry in new_entries}
+        await asyncio.gather(
+            self.put_entries(new_entries),
+            self.delete_entries(old_keys - new_keys),
+            self._count(new_keys - old_keys, 1),
+            self._count(old_keys - new_keys, -1),
+        )
+
+    async def delete(self, instance: DetaBase):
+        keys = list(self.entry_keys(instance))
+        await asyncio.gather(self.delete_entries(keys), self._count(keys, -1))
+
+    async def reconcile(self):
+        counts = Counter()
+        async for entry in self.iter_entries():
+            counts[self.counter_key(entry["key"])] += 1
+
+        await set_counts(f"{self.name}:", counts)
+
+    async def search(self, model: type[DetaBase], text: str):
+        """Returns the records of the matching rows with their `score`, the closest matches first
+
+        Every match holds all the required trigrams, so the candidates are the entries of the rarest one.
+        """
+        await self.ensure_built(model)
+
+        query = normalize(text)
+        required = list(required_trigrams(query))
+        if not required:
+            return []
+
+        counts = await asyncio.gather(*(get_count(f"{self.name}:{gram}") for gram in required))
+        # The trigrams indexed before they were counted are only used when none of them is counted
+        gram = min(zip((inf if count is None else count for count in counts), required))[1]
+
+        query_grams = trigrams(query)
+        records = []
+        async for record in self.iter_entries({"key?pfx": f"{gram}#"}):
+            if matches(query, record["words"]):
+                records.append({**record, "score": similarity(query_grams, trigrams(record["words"]))})
+
+        return sorted(records, key=lambda record: (-record["score"], record["words"], record["id"]))
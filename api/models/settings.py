@@ -1,5 +1,7 @@
 from typing import ClassVar, Optional
 
+from fastapi.encoders import jsonable_encoder
+
 from ..config import get_settings
 from ..fastapi_permissions import Allow, Everyone
 from .base import DetaBase
@@ -13,6 +15,7 @@ class Settings(DetaBase):
     title2: Optional[str]
     about: Optional[str]
     db_name: ClassVar = "settings"
+    cached: ClassVar = True
 
     __acl__ = (
         (Allow, [Everyone], "view"),
@@ -21,8 +24,15 @@ class Settings(DetaBase):
 
     @classmethod
     async def set(cls, **kwargs):
-        await cls(**kwargs).save()
+        # Carries the version on, so it keeps identifying the content of the settings
+        current = await cls.get()
+        await cls(**kwargs, version=current.version).save()
 
     @classmethod
     async def get(cls):
-        return await cls.find("settings", None) or cls()
+        settings = await cls.find("settings", None)
+        if settings is None:
+            settings = cls()
+            # The defaults are cached too, so a site without settings doesn't query them on every request
+            cls.cache().set(settings.id, jsonable_encoder(settings))
+        return settings
@@ -1,3 +1,4 @@
+from os import path
 from typing import ClassVar, Optional, Union
 from uuid import UUID
 
@@ -9,8 +10,14 @@ from .base import DetaBase
 class UploadedBlob(DetaBase):
     name: str
     session_id: UUID
+    # Page of the edited chapter the blob stands for, it's only copied if it changes place
+    source: Optional[str]
     db_name: ClassVar = "blobs"
 
+    @property
+    def path(self):
+        return self.source or path.join("blobs", f"{self.id}.jpg")
+
     @classmethod
     async def from_session(cls, session_id: UUID):
         return await UploadedBlob.fetch({"session_id": str(session_id)})
@@ -40,14 +47,14 @@ class UploadSession(DetaBase):
         )
 
     async def delete(self):
-        blobs = await UploadedBlob.fetch({"session_id": str(self.id)})
-        await DetaBase.delete_many(blobs)
+        blobs = UploadedBlob.iter_fetch({"session_id": str(self.id)})
+        result = await DetaBase.delete_many(blobs)
+        result.raise_for_failures("Some blobs of the session couldn't be deleted")
         await super().delete()
 
     @classmethod
     async def flush(cls):
-        sessions = await cls.fetch({})
-        return await DetaBase.delete_many(sessions)
+        return await DetaBase.delete_many(cls.iter_fetch({}))
 
 
 class UploadSessionBlobs(UploadSession):
@@ -1,11 +1,15 @@
+import asyncio
 from enum import Enum
 from typing import ClassVar, Optional, Union
 from uuid import UUID
 
 from pydantic import BaseModel, EmailStr
 
+from ..exceptions import BadRequestHTTPException
 from ..fastapi_permissions import Allow, Everyone
 from .base import DetaBase
+from .index import SortedIndex
+from .lookup import UniqueIndex
 
 
 class Role(str, Enum):
@@ -14,12 +18,24 @@ class Role(str, Enum):
     user = "user"
 
 
+by_username = SortedIndex("users_by_username", lambda user: user.username)
+by_login = UniqueIndex(
+    "users",
+    {"username": lambda user: user.username, "email": lambda user: user.email},
+    BadRequestHTTPException("That username or email is already in use"),
+)
+
+
 class User(DetaBase):
     role: Role = Role.admin
     username: str
     email: Optional[EmailStr]
     hashed_password: str
     db_name: ClassVar = "users"
+    cached: ClassVar = True
+    trusted: ClassVar = True
+    indexes: ClassVar = (by_username,)
+    unique: ClassVar = (by_login,)
 
     @property
     def __acl__(self):
@@ -45,36 +61,41 @@ class User(DetaBase):
     async def delete(self):
         from .comment import Comment
 
-        chapters = await Comment.fetch({"author_id": str(self.id)})
-
-        await DetaBase.delete_many(chapters)
+        comments = Comment.iter_fetch({"author_id": str(self.id)})
+        result = await DetaBase.delete_many(comments)
+        result.raise_for_failures("Some comments of the user couldn't be deleted")
         await super().delete()
 
     @classmethod
     async def from_username_email(cls, username_email: str, mail: str = "", ignore_user: UUID = None):
         if mail == "":
-            query = [{"username": username_email}, {"email": username_email}]
+            lookups = [("username", username_email), ("email", username_email)]
         elif mail is None:
-            query = [{"username": username_email}]
+            lookups = [("username", username_email)]
         else:
-            query = [{"username": username_email}, {"email": mail}]
+            lookups = [("username", username_email), ("email", mail)]
 
-        if ignore_user:
-            query = [{**x, "id,ne": str(ignore_user)} for x in query]
-
-        result = await cls.fetch(query, 3)
-
-        if result:
-            return result[0]
-        else:
-            return None
+        ids = await asyncio.gather(*(by_login.get(cls, field, value) for field, value in lookups))
+        for _id in ids:
+            if _id and _id != str(ignore_user):
+                user = await cls.find(_id, None)
+                if user:
+                    return user
+        return None
 
     @classmethod
-    async def search(cls, name: str = "", filters: Union[BaseModel, None] = None, limit: int = 20, offset: int = 0):
+    async def search(
+        cls,
+        name: str = "",
+        filters: Union[BaseModel, None] = None,
+        limit: int = 20,
+        offset: int = 0,
+        cursor: Optional[str] = None,
+    ):
         if filters is not None:
             filters = {k: v for k, v in filters.dict().items() if v}
         else:
             filters = {}
         if name:
             filters["username?contains"] = name
-        return await cls.pagination(filters, limit, offset, lambda x: getattr(x, "username"))
+        return await cls.pagination(by_username, filters, limit, offset, cursor)
@@ -0,0 +1,98 @@
+import asyncio
+from collections import Counter
+from datetime import datetime
+
+from .db import base_clients
+from .fs import media, page_path
+from .models.base import gather_bounded
+from .models.chapter import COMMIT_TIMEOUT, PAGE_COLLECT_DELAY, PAGE_REFS, STORED_PAGES, Chapter, ChapterStatus
+from .models.comment import Comment
+from .models.counter import delete_count, get_count, get_counters, get_counts, set_count
+from .models.manga import Manga
+from .models.user import User
+
+indexed_models = (Manga, Chapter, Comment, User)
+
+
+async def rebuild_indexes():
+    for model in indexed_models:
+        for index in (*model.indexes, *model.unique):
+            print(f"Rebuilding {index.name}...")
+            await index.rebuild(model)
+
+
+async def build_indexes():
+    """Builds the indexes that were never built, so that it's not done by the first requests using them"""
+    for model in indexed_models:
+        for index in (*model.indexes, *model.unique):
+            await index.ensure_built(model)
+
+
+async def reconcile_counts():
+    for model in indexed_models:
+        for index in model.indexes:
+            await index.reconcile()
+
+
+async def reconcile_page_refs():
+    """Recounts the references to the pages from the manifests of the chapters and the commits in progress
+
+    The counters are read first, so that a commit referencing or releasing pages in the meantime is counted twice
+    rather than missed. The commits in progress for longer than `COMMIT_TIMEOUT` were interrupted, their chapters
+    are marked as failed and their pages aren't counted anymore.
+    """
+    stored = await get_counts(PAGE_REFS)
+    commits = {commit["key"]: commit for commit in await get_counters(STORED_PAGES)}
+    cutoff = (datetime.now() - COMMIT_TIMEOUT).isoformat()
+    counts = Counter()
+    interrupted = []
+    async for chapter in Chapter.iter_fetch({}):
+        counts.update(f"{PAGE_REFS}{page}" for page in chapter.pages)
+        if chapter.status != ChapterStatus.processing:
+            continue
+        commit = commits.pop(f"{STORED_PAGES}{chapter.id}", {})
+        if commit.get("started", "") < cutoff:
+            interrupted.append((chapter, commit))
+        else:
+            counts.update(f"{PAGE_REFS}{page}" for page in commit.get("pages", []))
+
+    async def interrupt(chapter: Chapter, commit: dict):
+        failed = list(range(1, len(commit.get("pages", [])) + 1))
+        await chapter.update(status=ChapterStatus.failed, failed_pages=failed)
+        await delete_count(f"{STORED_PAGES}{chapter.id}")
+
+    released = {"released": datetime.now().isoformat()}
+    await gather_bounded(
+        [
+            *(
+                set_count(key, counts[key], **(released if counts[key] <= 0 else {}))
+                for key in stored.keys() | counts.keys()
+                if stored.get(key) != counts[key]
+            ),
+            *(interrupt(chapter, commit) for chapter, commit in interrupted),
+            # Left by the commits whose chapter was deleted, a recent one may belong to a commit about to start
+            *(delete_count(commit["key"]) for commit in commits.values() if commit.get("started", "") < cutoff),
+        ]
+    )
+
+
+async def collect_pages():
+    """Removes the stored pages no chapter referenced for `PAGE_COLLECT_DELAY`, along with their counters"""
+    cutoff = (datetime.now() - PAGE_COLLECT_DELAY).isoformat()
+    for counter in await get_counters(PAGE_REFS, {"value?lte": 0, "released?lt": cutoff}):
+        # A chapter may have referenced the page again in the meantime
+        if (await get_count(counter["key"]) or 0) > 0:
+            continue
+        await media.remove([page_path(counter["key"].removeprefix(PAGE_REFS))])
+        await delete_count(counter["key"])
+
+
+async def main():
+    try:
+        await rebuild_indexes()
+    finally:
+        await base_clients.close()
+
+
+if __name__ == "__main__":
+    asyncio.get_event_loop().run_until_complete(main())
@@ -1,13 +1,27 @@
-from fastapi import APIRouter
+from typing import Optional
 
-from ..models.chapter import Chapter
+from fastapi import APIRouter, Header, Response, status
+
+from ..etag import etag_matches, make_etag
+from ..models.chapter import scan_groups
 
 router = APIRouter(prefix="/autocomplete", tags=["Autocomplete"])
 
+get_groups_responses = {
+    304: {"description": "The groups didn't change since the version in If-None-Match"},
+}
+
 
-@router.get("/groups", response_model=list[str])
-async def get_scan_groups():
-    groups = await Chapter.get_groups()
-    if "no group" not in groups:
+@router.get("/groups", response_model=list[str], responses=get_groups_responses)
+async def get_scan_groups(response: Response, q: str = "", if_none_match: Optional[str] = Header(None)):
+    """Provides the known scan groups starting with `q`."""
+    groups = await scan_groups.search(q)
+    if "no group" not in groups and "no group".startswith(q.casefold()):
         groups.append("no group")
+
+    etag = make_etag(*groups)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
     return groups
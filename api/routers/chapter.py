@@ -31,13 +31,15 @@ async def _get_detailed_chapter(chapter_id: UUID):
 async def get_latest_chapters(
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
 ):
-    count, page = await Chapter.latest(limit, offset)
+    count, page, next_cursor = await Chapter.latest(limit, offset, cursor)
     return {
         "offset": offset,
         "limit": limit,
         "results": page,
         "total": count,
+        "next_cursor": next_cursor,
     }
 
 
@@ -55,7 +57,7 @@ get_responses = {
 
 @router.get("/{chapter_id}", response_model=DetailedChapterResponse, responses=get_responses)
 async def get_chapter(chapter: DetailedChapter = Permission("view", _get_detailed_chapter)):
-    return chapter
+    return {**chapter.dict(), "stored_pages": await chapter.progress()}
 
 
 delete_responses = {
@@ -74,7 +76,7 @@ delete_responses = {
 
 @router.delete("/{chapter_id}", dependencies=[Depends(is_connected)], responses=delete_responses)
 async def delete_chapter(chapter: Chapter = Permission("edit", _get_chapter)):
-    media.rmtree(path.join(str(chapter.manga_id), str(chapter.id)))
+    await media.rmtree(path.join(str(chapter.manga_id), str(chapter.id)))
     return await chapter.delete()
 
 
@@ -112,16 +114,18 @@ get_comments_responses = {
 async def get_chapter_comments(
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
     chapter: Chapter = Permission("view", _get_chapter),
     user_principals=Depends(get_active_principals),
 ):
     if await has_permission(user_principals, "view", Chapter.__class_acl__()):
-        count, page = await DetailedComment.from_chapter(chapter.id, limit, offset)
+        count, page, next_cursor = await DetailedComment.from_chapter(chapter.id, limit, offset, cursor)
         return {
             "offset": offset,
             "limit": limit,
             "results": page,
             "total": count,
+            "next_cursor": next_cursor,
         }
     else:
         raise permission_exception
@@ -11,10 +11,10 @@ from ..exceptions import BadRequestHTTPException, NotFoundHTTPException
 from ..fastapi_permissions import has_permission, permission_exception
 from ..fs import media
 from ..models.chapter import Chapter
-from ..models.manga import Manga
+from ..models.manga import Manga, Sort, Status
 from ..models.user import User
 from ..schemas.chapter import ChapterResponse
-from ..schemas.manga import MangaResponse, MangaSchema, MangaSearchResponse
+from ..schemas.manga import MangaFilters, MangaResponse, MangaSchema, MangaSearchResponse
 from .auth import Permission, auth_responses, get_active_principals, get_connected_user
 
 settings = get_settings()
@@ -51,15 +51,24 @@ async def create_manga(payload: MangaSchema, user: User = Depends(get_connected_
 @router.get("", response_model=MangaSearchResponse, dependencies=[Permission("view", Manga.__class_acl__)])
 async def search_manga(
     title: str = "",
+    status: Optional[Status] = None,
+    year: Optional[int] = None,
+    author: Optional[str] = None,
+    artist: Optional[str] = None,
+    sort: Sort = Query(Sort.relevance, description="Order of the results, by relevance when searching a title"),
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
 ):
-    count, page = await Manga.search(title, limit, offset)
+    filters = MangaFilters(status=status, year=year, author=author, artist=artist)
+    count, page, next_cursor, facets = await Manga.search(title, filters, sort, limit, offset, cursor)
     return {
         "offset": offset,
         "limit": limit,
         "results": page,
         "total": count,
+        "next_cursor": next_cursor,
+        "facets": facets,
     }
 
 
@@ -115,7 +124,7 @@ delete_responses = {
 
 @router.delete("/{manga_id}", responses=delete_responses)
 async def delete_manga(manga: Manga = Permission("edit", _get_manga)):
-    media.rmtree(str(manga.id))
+    await media.rmtree(str(manga.id))
     return await manga.delete()
 
 
@@ -140,7 +149,7 @@ def save_cover(manga_id: UUID, file: File):
     with TemporaryFile() as f:
         im.convert("RGB").save(f, "JPEG")
         f.seek(0)
-        media.put(path.join(str(manga_id), "cover.jpg"), f)
+        media.drive.put(path.join(str(manga_id), "cover.jpg"), f)
 
 
 put_cover_responses = {
@@ -162,7 +171,7 @@ async def set_manga_cover(payload: UploadFile = File(...), manga: Manga = Permis
     if not payload.content_type.startswith("image/"):
         raise BadRequestHTTPException(f"'{payload.filename}' is not an image")
 
-    save_cover(manga.id, payload.file)
+    await media.run(save_cover, manga.id, payload.file)
     await manga.save()
 
     return manga
@@ -1,19 +1,177 @@
-from fastapi import APIRouter
-from fastapi.responses import StreamingResponse
+import os
+import re
+from typing import Optional
 
-from ..exceptions import NotFoundHTTPException
-from ..fs import media
+from fastapi import APIRouter, Header, Query, status
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from PIL import UnidentifiedImageError
+
+from ..config import get_settings
+from ..etag import etag_matches
+from ..exceptions import BadRequestHTTPException, NotFoundHTTPException, RangeNotSatisfiableHTTPException
+from ..fs import PAGES_PATH, file_size, guess_type, iter_file, iter_local_range, iter_range, media, page_path
+from ..images import get_variant, negotiate, variant_path
+from ..models.chapter import Chapter
+from ..models.upload import UploadedBlob
+
+settings = get_settings()
 
 router = APIRouter(prefix="/media", tags=["Media"])
 
+_byte_range = re.compile(r"bytes=(\d*)-(\d*)")
+_blob_file = re.compile(r"blobs/([0-9a-f-]{36})\.jpg")
+_chapter_page = re.compile(r"[0-9a-f-]{36}/([0-9a-f-]{36})/(\d+)\.jpg")
+_page_file = re.compile(rf"{PAGES_PATH}/[0-9a-f]{{64}}\.jpg")
+
+
+def parse_range(header: Optional[str], size: Optional[int]):
+    """Returns the first and last byte of the requested range, or None to send the whole file
+
+    Only single ranges are supported, the others are ignored as allowed by RFC 7233.
+    """
+    if not header or size is None:
+        return None
+    match = _byte_range.fullmatch(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+
+    first, last = match.groups()
+    if first and last and int(last) < int(first):
+        return None
+    if size == 0 or (first and int(first) >= size) or (not first and int(last) == 0):
+        raise RangeNotSatisfiableHTTPException(size)
+
+    if not first:
+        # Suffix range, the last bytes of the file
+        return max(size - int(last), 0), size - 1
+    return int(first), min(int(last), size - 1) if last else size - 1
+
 
-@router.get("/{file:path}")
-async def get_media_file(file: str):
+def range_headers(start: int, end: int, size: int):
+    return {"Content-Length": str(end - start + 1), "Content-Range": f"bytes {start}-{end}/{size}"}
+
+
+class MediaFileResponse(FileResponse):
+    chunk_size = settings.media_chunk_size
+
+    def set_stat_headers(self, stat_result):
+        # The times of the local copy don't tell when the file changed, its ETag comes from the Drive
+        self.headers.setdefault("content-length", str(stat_result.st_size))
+
+
+def local_file_response(local_path: str, range: Optional[str], media_type: str, headers: dict) -> Optional[Response]:
+    """Sends the local copy of a file, None if it was evicted from the cache in the meantime"""
+    try:
+        stat_result = os.stat(local_path)
+    except FileNotFoundError:
+        return None
+
+    byte_range = parse_range(range, stat_result.st_size)
+    if byte_range is None:
+        return MediaFileResponse(local_path, stat_result=stat_result, media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    return StreamingResponse(
+        iter_local_range(local_path, start, end, settings.media_chunk_size),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={**headers, **range_headers(start, end, stat_result.st_size)},
+    )
+
+
+get_responses = {
+    206: {"description": "The requested range of the file"},
+    304: {"description": "The file didn't change since the version in If-None-Match"},
+    400: {
+        "description": "The requested size isn't one of the available ones, or the file isn't an image",
+        **BadRequestHTTPException.open_api("The size must be one of 160, 320, 640, 1280"),
+    },
+    404: {
+        "description": "The file couldn't be found",
+        **NotFoundHTTPException.open_api(),
+    },
+    416: {
+        "description": "The requested range is outside of the file",
+        **RangeNotSatisfiableHTTPException.open_api(),
+    },
+}
+
+
+@router.get("/{file:path}", responses=get_responses)
+async def get_media_file(
+    file: str,
+    w: Optional[int] = Query(None, description="Width the image is resized to fit in"),
+    h: Optional[int] = Query(None, description="Height the image is resized to fit in"),
+    range: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+    accept: Optional[str] = Header(None),
+):
     """Get the media files from Deta Drive"""
-    headers = {"Cache-Control": "max-age=1728000"}
+    headers = {"Cache-Control": "max-age=1728000", "Accept-Ranges": "bytes"}
+
+    if _page_file.fullmatch(file):
+        # The content of a page never changes, it's stored under its hash
+        headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    elif (match := _blob_file.fullmatch(file)) and (blob := await UploadedBlob.find(match[1], None)):
+        # The blobs of an edit session may reference the pages of the chapter
+        file = blob.path
+    elif (match := _chapter_page.fullmatch(file)) and (chapter := await Chapter.find(match[1], None)):
+        # The pages of a chapter are still served by number, when it has a manifest
+        if 0 < int(match[2]) <= len(chapter.pages):
+            file = page_path(chapter.pages[int(match[2]) - 1])
+
+    if w is not None or h is not None:
+        if any(size is not None and size not in settings.media_variant_sizes for size in (w, h)):
+            sizes = ", ".join(map(str, settings.media_variant_sizes))
+            raise BadRequestHTTPException(f"The size must be one of {sizes}")
+        try:
+            file = await get_variant(file, w, h)
+        except FileNotFoundError:
+            raise NotFoundHTTPException()
+        except UnidentifiedImageError:
+            raise BadRequestHTTPException("The file isn't an image")
+
+    meta = await media.cached_stat(file)
+    if meta and meta.get("encodings"):
+        headers["Vary"] = "Accept"
+        if encoding := negotiate(meta, accept):
+            encoded = variant_path(file, extension=encoding)
+            if encoded_meta := await media.cached_stat(encoded):
+                file, meta = encoded, encoded_meta
+
+    if meta:
+        headers["ETag"] = meta["etag"]
+        if etag_matches(if_none_match, meta["etag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    media_type = meta["content_type"] if meta else guess_type(file)
 
     try:
-        res = media.get(file)
+        local_path = await media.local_copy(file)
+        if local_path and (response := local_file_response(local_path, range, media_type, headers)):
+            return response
+        res = await media.get(file)
     except FileNotFoundError:
         raise NotFoundHTTPException()
-    return StreamingResponse(res.iter_chunks(1024), media_type="image/png", headers=headers)
+
+    size = file_size(res)
+    if size is None and meta:
+        size = meta["size"]
+    try:
+        byte_range = parse_range(range, size)
+    except RangeNotSatisfiableHTTPException:
+        await media.run(res.close)
+        raise
+
+    if byte_range is None:
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        chunks = iter_file(res, settings.media_chunk_size)
+        return StreamingResponse(media.iterate(chunks), media_type=media_type, headers=headers)
+
+    start, end = byte_range
+    return StreamingResponse(
+        media.iterate(iter_range(res, start, end, settings.media_chunk_size)),
+        status_code=status.HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers={**headers, **range_headers(start, end, size)},
+    )
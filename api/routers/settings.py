@@ -1,5 +1,8 @@
-from fastapi import APIRouter
+from typing import Optional
 
+from fastapi import APIRouter, Header, Response, status
+
+from ..etag import etag_matches, make_etag
 from ..models.settings import Settings
 from ..schemas.settings import SettingsSchema
 from .auth import Permission, auth_responses
@@ -7,9 +10,21 @@ from .auth import Permission, auth_responses
 router = APIRouter(prefix="/settings", tags=["Settings"])
 
 
-@router.get("", response_model=SettingsSchema, dependencies=[Permission("view", Settings)])
-async def get_site_settings():
-    return await Settings.get()
+get_responses = {
+    304: {"description": "The settings didn't change since the version in If-None-Match"},
+}
+
+
+@router.get("", response_model=SettingsSchema, dependencies=[Permission("view", Settings)], responses=get_responses)
+async def get_site_settings(response: Response, if_none_match: Optional[str] = Header(None)):
+    settings = await Settings.get()
+
+    etag = make_etag("settings", str(settings.version))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    response.headers["ETag"] = etag
+    return settings
 
 
 put_responses = {
@@ -1,3 +1,6 @@
+import asyncio
+import logging
+from datetime import datetime
 from os import listdir, makedirs, path, remove
 from shutil import rmtree
 from tempfile import TemporaryFile
@@ -14,8 +17,10 @@ from pyunpack import Archive
 from ..config import get_settings
 from ..exceptions import BadRequestHTTPException, NotFoundHTTPException
 from ..fastapi_permissions import has_permission, permission_exception
-from ..fs import media
-from ..models.chapter import Chapter
+from ..fs import iter_file, media, page_path
+from ..images import make_encodings
+from ..models.chapter import STORED_PAGES, Chapter, ChapterStatus, release_pages, retain_pages
+from ..models.counter import delete_count, increment, set_count
 from ..models.manga import Manga
 from ..models.upload import UploadedBlob, UploadSession, UploadSessionBlobs
 from ..models.user import User
@@ -25,6 +30,8 @@ from .auth import Permission, auth_responses, get_active_principals, is_connecte
 
 global_settings = get_settings()
 
+log = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/upload", tags=["Upload"])
 
 
@@ -36,12 +43,6 @@ async def _get_upload_session_blobs(session_id: UUID):
     return await UploadSessionBlobs.find(session_id, NotFoundHTTPException("Session not found"))
 
 
-def copy_chapter_to_session(chapter: Chapter, blobs: list[UUID]):
-    chapter_path = path.join(str(chapter.manga_id), str(chapter.id))
-    for i in range(chapter.length):
-        media.copy(path.join(chapter_path, f"{i + 1}.jpg"), path.join("blobs", f"{blobs[i]}.jpg"))
-
-
 post_responses = {
     **auth_responses,
     404: {
@@ -86,12 +87,17 @@ async def begin_upload_session(
     makedirs(path.join(session_path, "files"))
 
     if chapter:
-        blobs = []
-        for i in range(1, chapter.length + 1):
-            blob = UploadedBlob(session_id=session.id, name=f"{i}.jpg")
-            await blob.save()
-            blobs.append(blob.id)
-        copy_chapter_to_session(chapter, blobs)
+        # The blobs reference the pages of the chapter, which are never copied when they're kept
+        chapter_path = path.join(str(chapter.manga_id), str(chapter.id))
+        sources = (
+            [page_path(page) for page in chapter.pages]
+            if chapter.pages
+            else [path.join(chapter_path, f"{i}.jpg") for i in range(1, chapter.length + 1)]
+        )
+        blobs = [
+            UploadedBlob(session_id=session.id, name=f"{i}.jpg", source=source) for i, source in enumerate(sources, 1)
+        ]
+        await UploadedBlob.save_many(blobs)
 
     return await UploadSessionBlobs.find(session.id)
 
@@ -120,7 +126,7 @@ def save_session_image(files: Iterable[tuple[UUID, str]]):
         with TemporaryFile() as f:
             im.convert("RGB").save(f, "JPEG")
             f.seek(0)
-            media.put(path.join("blobs", f"{blob_id}.jpg"), f)
+            media.drive.put(path.join("blobs", f"{blob_id}.jpg"), f)
         remove(file)
 
 
@@ -188,20 +194,18 @@ async def upload_pages_to_upload_session(
                 await out_file.write(content)
             files = (file.filename,)
 
-        file_blobs = []
-        for f in files:
-            file_blob = UploadedBlob(session_id=session.id, name=f)
-            await file_blob.save()
-            blobs.append(file_blob)
-            file_blobs.append(file_blob.id)
+        file_blobs = [UploadedBlob(session_id=session.id, name=f) for f in files]
+        await UploadedBlob.save_many(file_blobs)
+        blobs.extend(file_blobs)
 
-        save_session_image(zip(file_blobs, (path.join(files_path, f) for f in files)))
+        file_paths = [path.join(files_path, f) for f in files]
+        await media.run(save_session_image, zip((b.id for b in file_blobs), file_paths))
 
     return blobs
 
 
-def delete_session_images(ids: list[UUID]):
-    media.remove([path.join("blobs", f"{blob_id}.jpg") for blob_id in ids])
+async def delete_session_images(blobs: Iterable[UploadedBlob]):
+    await media.remove([blob.path for blob in blobs if not blob.source])
 
 
 delete_responses = {
@@ -221,30 +225,108 @@ delete_responses = {
 async def delete_upload_session(
     tasks: BackgroundTasks, session: UploadSessionBlobs = Permission("edit", _get_upload_session_blobs)
 ):
-    session_images = (b.id for b in session.blobs)
     await session.delete()
     session_path = path.join(global_settings.temp_path, str(session.id))
     tasks.add_task(rmtree, session_path, True)
-    tasks.add_task(delete_session_images, session_images)
+    tasks.add_task(delete_session_images, session.blobs)
     return "OK"
 
 
-def commit_session_images(chapter: Chapter, pages: list[UUID], edit: bool):
-    chapter_path = path.join(str(chapter.manga_id), str(chapter.id))
-
-    if edit:
-        media.rmtree(chapter_path, True)
-
-    page_number = 1
-    for page in pages:
-        media.move(path.join("blobs", f"{page}.jpg"), path.join(chapter_path, f"{page_number}.jpg"))
-        page_number += 1
+async def retry(function, source: str, *args, semaphore: asyncio.Semaphore):
+    """Calls the Drive for a page, retrying with an exponential backoff when it fails"""
+    async with semaphore:
+        for attempt in range(global_settings.page_move_retries + 1):
+            try:
+                return await function(source, *args)
+            except FileNotFoundError:
+                raise
+            except Exception:
+                if attempt == global_settings.page_move_retries:
+                    raise
+                log.warning("Couldn't store %s, retrying", source, exc_info=True)
+            await asyncio.sleep(0.5 * 2**attempt)
+
+
+async def for_pages(function, sources: list[str], *args: list, semaphore: asyncio.Semaphore, on_done=None):
+    """Calls the Drive for each page, returns the results and the numbers of the pages for which it failed"""
+
+    async def call(*call_args):
+        result = await retry(function, *call_args, semaphore=semaphore)
+        if on_done:
+            await on_done()
+        return result
+
+    results = await asyncio.gather(*(call(*call_args) for call_args in zip(sources, *args)), return_exceptions=True)
+    for source, result in zip(sources, results):
+        if isinstance(result, Exception):
+            log.error("Couldn't store %s", source, exc_info=result)
+    return results, [number for number, result in enumerate(results, 1) if isinstance(result, Exception)]
+
+
+async def close_upload_session(session: UploadSessionBlobs):
+    try:
+        await session.delete()
+        rmtree(path.join(global_settings.temp_path, str(session.id)), True)
+        await delete_session_images(session.blobs)
+    except Exception:
+        log.exception("Couldn't delete the upload session %s", session.id)
+
+
+async def commit_session_images(session: UploadSessionBlobs, chapter: Chapter, pages: list[UploadedBlob]):
+    """Stores the new pages under their hash and writes the manifest of the chapter, marking it as ready
+
+    The pages are referenced before they're stored so that the cron can't remove the ones already there. The
+    stored ones are counted while it's processing, and when some of them can't be stored the chapter is marked
+    as failed with their numbers, keeping its previous pages and length. The session is only deleted once its
+    pages are stored, so that it can be committed again after a failure.
+    """
+    semaphore = asyncio.Semaphore(global_settings.page_move_concurrency_limit)
+    sources = [blob.path for blob in pages]
+    progress = f"{STORED_PAGES}{chapter.id}"
+
+    async def count_stored():
+        try:
+            await increment(progress)
+        except Exception:
+            log.warning("Couldn't count the stored pages of the chapter %s", chapter.id, exc_info=True)
+
+    hashes, failed = await for_pages(media.content_hash, sources, semaphore=semaphore)
+    if not failed:
+        # The cron counts the pages of the commits in progress along with the manifests
+        await increment(progress, 0, pages=hashes)
+        await retain_pages(hashes)
+        stored, failed = await for_pages(media.store_page, sources, hashes, semaphore=semaphore, on_done=count_stored)
+        if failed:
+            await release_pages(hashes)
+    await delete_count(progress)
+
+    # The chapter may have been edited or deleted in the meantime
+    if not (current := await Chapter.find(chapter.id, None)):
+        if not failed:
+            await release_pages(hashes)
+        await close_upload_session(session)
+        return
+    if failed:
+        await current.update(status=ChapterStatus.failed, failed_pages=failed)
+        return
+
+    previous = current.pages
+    await current.update(pages=hashes, length=len(hashes), status=ChapterStatus.ready, failed_pages=[])
+    await release_pages(previous)
+    await close_upload_session(session)
+    if session.chapter_id and not previous:
+        # The pages of the chapters uploaded before the manifest were stored by number
+        try:
+            await media.rmtree(path.join(str(chapter.manga_id), str(chapter.id), ""))
+        except Exception:
+            log.exception("Couldn't remove the previous pages of the chapter %s", chapter.id)
+    await make_encodings({page_path(page) for page, copied in zip(hashes, stored) if copied})
 
 
 post_commit_responses = {
     **auth_responses,
     400: {
-        "description": "There is a problem with the provided page order",
+        "description": "There is a problem with the provided page order, or the chapter is already processing",
         **BadRequestHTTPException.open_api("Some pages don't belong to this session"),
     },
     404: {
@@ -266,7 +348,7 @@ post_commit_responses = {
 async def commit_upload_session(
     payload: CommitUploadSession, tasks: BackgroundTasks, session=Permission("edit", _get_upload_session_blobs)
 ):
-    blobs = [b.id for b in session.blobs]
+    blobs = {b.id: b for b in session.blobs}
     edit = session.chapter_id is not None
     if not len(payload.page_order) > 0:
         raise BadRequestHTTPException("At least one page needs to be provided")
@@ -275,23 +357,27 @@ async def commit_upload_session(
 
     if session.chapter_id:
         chapter = await Chapter.find(session.chapter_id, NotFoundHTTPException("Chapter not found"))
-        await chapter.update(length=len(payload.page_order), **payload.chapter_draft.dict())
+        if chapter.status == ChapterStatus.processing:
+            raise BadRequestHTTPException("The pages of the chapter are already being stored")
+        await set_count(f"{STORED_PAGES}{chapter.id}", 0, started=datetime.now().isoformat())
+        # The length is only changed along with the pages, once they're stored
+        await chapter.update(status=ChapterStatus.processing, **payload.chapter_draft.dict())
     else:
         chapter = Chapter(
             manga_id=session.manga_id,
             length=len(payload.page_order),
             owner_id=session.owner_id,
+            status=ChapterStatus.processing,
             **payload.chapter_draft.dict(),
         )
+        await set_count(f"{STORED_PAGES}{chapter.id}", 0, started=datetime.now().isoformat())
         await chapter.save()
+        # Committing the session again after a failure edits that chapter
+        await UploadSession(**session.dict(exclude={"blobs"})).update(chapter_id=chapter.id)
 
-    session_path = path.join(global_settings.temp_path, str(session.id))
-    tasks.add_task(rmtree, session_path, True)
-
-    await session.delete()
-
-    commit_session_images(chapter, payload.page_order, edit)
-    tasks.add_task(delete_session_images, set(blobs).difference(payload.page_order))
+    # The pages are stored once the response is sent, the status of the chapter tells when they're all there
+    pages = [blobs[page] for page in payload.page_order]
+    tasks.add_task(commit_session_images, session, chapter, pages)
     content = jsonable_encoder(ChapterResponse.from_orm(chapter))
     return JSONResponse(status_code=(200 if edit else 201), content=content)
 
@@ -313,10 +399,10 @@ delete_all_blobs_responses = {
 async def delete_all_pages_from_upload_session(
     tasks: BackgroundTasks, session: UploadSessionBlobs = Permission("edit", _get_upload_session_blobs)
 ):
-    session_images = (b.id for b in session.blobs)
-    tasks.add_task(delete_session_images, session_images)
+    tasks.add_task(delete_session_images, session.blobs)
 
-    await UploadedBlob.delete_many(session.blobs)
+    result = await UploadedBlob.delete_many(session.blobs)
+    result.raise_for_failures("Some pages couldn't be deleted")
 
     return "OK"
 
@@ -347,21 +433,20 @@ async def delete_page_from_upload_session(
 
     blob = await UploadedBlob.find(file_id, NotFoundHTTPException("Blob not found"))
     await blob.delete()
-    tasks.add_task(delete_session_images, (file_id,))
+    tasks.add_task(delete_session_images, (blob,))
     return "OK"
 
 
-async def concat_and_cut_images(blob_ids: Iterable[UUID]):
+async def concat_and_cut_images(blobs: Iterable[UploadedBlob]):
     images = []
     temp_files = []
 
-    for blob_id in blob_ids:
-        big_file = media.get(path.join("blobs", f"{blob_id}.jpg"))
+    for blob in blobs:
+        big_file = await media.get(blob.path)
 
         f = TemporaryFile()
-        for chunk in big_file.iter_chunks(4096):
+        async for chunk in media.iterate(iter_file(big_file, 4096)):
             f.write(chunk)
-        big_file.close()
         f.seek(0)
 
         images.append(Image.open(f))
@@ -418,30 +503,30 @@ async def slice_pages_in_upload_session(
     tasks: BackgroundTasks,
     session=Permission("edit", _get_upload_session_blobs),
 ):
-    blobs = [b.id for b in session.blobs]
+    blobs = {b.id: b for b in session.blobs}
 
     if not len(payload) > 0:
         raise BadRequestHTTPException("At least one page needs to be provided")
     if len(set(payload).difference(blobs)) > 0:
         raise BadRequestHTTPException("Some pages don't belong to this session")
 
-    parts = await concat_and_cut_images(payload)
+    parts = await concat_and_cut_images(blobs[blob_id] for blob_id in payload)
 
-    for i, part in enumerate(parts):
-        file_blob = UploadedBlob(session_id=session.id, name=f"slice_{i+1}.jpg")
-        await file_blob.save()
+    part_blobs = [UploadedBlob(session_id=session.id, name=f"slice_{i+1}.jpg") for i in range(len(parts))]
+    await UploadedBlob.save_many(part_blobs)
 
+    for part, file_blob in zip(parts, part_blobs):
         with TemporaryFile() as f:
             part.save(f, "JPEG")
             f.seek(0)
-            media.put(path.join("blobs", f"{file_blob.id}.jpg"), f)
+            await media.put(path.join("blobs", f"{file_blob.id}.jpg"), f)
 
         part.close()
 
-    for blob_id in payload:
-        blob: UploadedBlob = await UploadedBlob.find(blob_id)
-        await blob.delete()
+    sliced = [blobs[blob_id] for blob_id in set(payload)]
+    result = await UploadedBlob.delete_many(sliced)
+    result.raise_for_failures("Some of the sliced pages couldn't be deleted")
 
-    tasks.add_task(delete_session_images, payload)
+    tasks.add_task(delete_session_images, sliced)
 
     return await UploadedBlob.from_session(session.id)
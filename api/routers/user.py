@@ -190,19 +190,22 @@ get_all_responses = {
 async def search_users(
     limit: Optional[int] = Query(10, ge=1, le=settings.max_page_limit),
     offset: Optional[int] = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
     username: str = "",
     role: Optional[Role] = None,
     email: Optional[str] = None,
     user_id: Optional[UUID] = None,
     _: User = Permission("view", User.__class_acl__),
 ):
-    count, page = await User.search(username, UserFilters(role=role, email=email, id=user_id), limit, offset)
+    filters = UserFilters(role=role, email=email, id=user_id)
+    count, page, next_cursor = await User.search(username, filters, limit, offset, cursor)
 
     return {
         "offset": offset,
         "limit": limit,
         "results": page,
         "total": count,
+        "next_cursor": next_cursor,
     }
 
 
@@ -211,7 +214,7 @@ def save_avatar(user_id: UUID, file: File):
     with TemporaryFile() as f:
         im.convert("RGB").save(f, "JPEG")
         f.seek(0)
-        media.put(path.join("users", f"{user_id}.jpg"), f)
+        media.drive.put(path.join("users", f"{user_id}.jpg"), f)
 
 
 put_avatar_responses = {
@@ -235,7 +238,7 @@ async def set_avatar(
     if not payload.content_type.startswith("image/"):
         raise BadRequestHTTPException(f"'{payload.filename}' is not an image")
 
-    save_avatar(user.id, payload.file)
+    await media.run(save_avatar, user.id, payload.file)
     await user.save()
 
     return user
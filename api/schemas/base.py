@@ -1,3 +1,5 @@
+from typing import Optional
+
 from fastapi_camelcase import CamelModel
 from pydantic import Field
 
@@ -11,6 +13,7 @@ class PaginationResponse(CamelModel):
     limit: int = Field(..., ge=1, le=settings.max_page_limit)
     results: list
     total: int = Field(..., ge=0)
+    next_cursor: Optional[str] = Field(description="Cursor to request the next page with, if there is one")
 
     class Config:
         orm_mode = True
@@ -5,6 +5,7 @@ from uuid import UUID
 from fastapi_camelcase import CamelModel
 from pydantic import Field
 
+from ..models.chapter import ChapterStatus
 from .base import PaginationResponse
 from .manga import MangaResponse
 
@@ -49,6 +50,22 @@ class ChapterResponse(ChapterSchema):
         description="Time this chapter was uploaded",
     )
     owner_id: Optional[UUID] = Field(description="User that uploaded this chapter")
+    status: ChapterStatus = Field(
+        ChapterStatus.ready,
+        description="If the pages are still being stored, or if some of them couldn't be",
+    )
+    pages: list[str] = Field(
+        [],
+        description="Hashes of the pages in order, served at `/media/pages/<hash>.jpg`",
+    )
+    stored_pages: Optional[int] = Field(
+        None,
+        description="Amount of pages already stored, while the chapter is processing",
+    )
+    failed_pages: list[int] = Field(
+        [],
+        description="Numbers of the pages that couldn't be stored, when the chapter failed",
+    )
 
     class Config:
         orm_mode = True
@@ -65,6 +82,8 @@ class ChapterResponse(ChapterSchema):
                 "scanGroup": "Monochrome Scans",
                 "uploadTime": "2000-08-24 00:00:00",
                 "ownerId": "6901d7f6-c4e1-4200-9dd0-a6fccc065978",
+                "status": ChapterStatus.ready,
+                "pages": ["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"],
             }
         }
 
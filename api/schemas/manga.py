@@ -71,5 +71,20 @@ class MangaResponse(MangaSchema):
         }
 
 
+class MangaFacets(CamelModel):
+    status: dict[str, int] = Field(description="Amount of matching manga for each status")
+    year: dict[str, int] = Field(description="Amount of matching manga for each year")
+    author: dict[str, int] = Field(description="Amount of matching manga for each author")
+    artist: dict[str, int] = Field(description="Amount of matching manga for each artist")
+
+
 class MangaSearchResponse(PaginationResponse):
     results: list[MangaResponse]
+    facets: MangaFacets
+
+
+class MangaFilters(CamelModel):
+    status: Optional[Status]
+    year: Optional[int]
+    author: Optional[str]
+    artist: Optional[str]
@@ -0,0 +1,38 @@
+from api.cache import LRUCache, NullCache
+
+
+def test_lru_eviction():
+    cache = LRUCache("test", 2, 60)
+    cache.set("a", {"version": 1})
+    cache.set("b", {"version": 1})
+    cache.get("a")
+    cache.set("c", {"version": 1})
+
+    assert cache.get("a") == {"version": 1}
+    assert cache.get("b") is None
+    assert cache.get("c") == {"version": 1}
+
+
+def test_lru_expiration():
+    cache = LRUCache("test", 2, 0.000001)
+    cache.set("a", {"version": 1})
+
+    assert cache.get("a") is None
+
+
+def test_lru_versions():
+    cache = LRUCache("test", 2, 60)
+    cache.set("a", {"version": 3, "title": "new"})
+    cache.set("a", {"version": 2, "title": "old"})
+
+    assert cache.get("a") == {"version": 3, "title": "new"}
+
+    cache.delete("a")
+    assert cache.get("a") is None
+
+
+def test_null_cache():
+    cache = NullCache()
+    cache.set("a", {"version": 1})
+
+    assert cache.get("a") is None
@@ -0,0 +1,28 @@
+import asyncio
+
+from api.models import counter
+from api.models.counter import get_count, get_counts, increment, set_counts
+from api.tests.unit.utils import fake_clients
+
+
+def test_increment(monkeypatch):
+    counters = fake_clients(monkeypatch, counter)[counter.COUNTERS_DB]
+
+    async def count():
+        await increment("test:a")
+        await asyncio.gather(*(increment("test:a", 2, released="now") for _ in range(3)))
+        await increment("test:b", -1)
+        return await get_count("test:a"), await get_count("test:b"), await get_count("test:c")
+
+    assert asyncio.run(count()) == (7, -1, None)
+    assert counters.items["test:a"]["released"] == "now"
+
+
+def test_set_counts(monkeypatch):
+    counters = fake_clients(monkeypatch, counter)[counter.COUNTERS_DB]
+    for key, value in (("test:a", 1), ("test:b", 2), ("other", 3)):
+        counters.items[key] = {"key": key, "value": value}
+
+    asyncio.run(set_counts("test:", {"test:b": 5, "test:c": 0}))
+    assert asyncio.run(get_counts("test:")) == {"test:b": 5, "test:c": 0}
+    assert counters.items["other"]["value"] == 3
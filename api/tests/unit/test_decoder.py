@@ -0,0 +1,50 @@
+from uuid import uuid4
+
+import pytest
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+
+from api.models.chapter import Chapter, DetailedChapter
+from api.models.decoder import compile_decoder
+from api.models.manga import Manga
+from api.models.user import User
+
+
+def test_trusted_decode():
+    manga = Manga(title="Title", description="Description", author="Author", artist="Artist", status="ongoing")
+    row = jsonable_encoder(manga)
+
+    decoded = Manga.from_db(row)
+    assert decoded == manga
+    assert decoded.__fields_set__ == Manga(**row).__fields_set__
+
+
+def test_trusted_decode_defaults():
+    row = jsonable_encoder(User(username="username", email="user@example.com", hashed_password="hash"))
+    del row["version"]
+
+    assert User.from_db(row).version == 1
+
+
+def test_trusted_decode_fallback():
+    row = jsonable_encoder(User(username="username", email="user@example.com", hashed_password="hash"))
+
+    with pytest.raises(ValidationError):
+        User.from_db({**row, "role": None})
+    with pytest.raises(ValidationError):
+        User.from_db({**row, "role": "unknown"})
+
+
+def test_trusted_decode_lists():
+    chapter = Chapter(name="Name", scan_group="Group", number=1, length=2, manga_id=uuid4(), pages=["a", "b"])
+    row = jsonable_encoder(chapter)
+
+    assert Chapter.from_db(row) == chapter
+    with pytest.raises(ValidationError):
+        Chapter.from_db({**row, "pages": "ab"})
+
+
+def test_untrusted_fields():
+    assert compile_decoder(Manga) is not None
+    assert compile_decoder(Chapter) is not None
+    assert compile_decoder(DetailedChapter) is None
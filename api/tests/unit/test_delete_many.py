@@ -0,0 +1,74 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp import ClientResponseError
+
+from api.models import base
+from api.models.base import DetaBase
+
+
+class Row:
+    active = 0
+    max_active = 0
+    deleted = 0
+
+    def __init__(self, id: int, fails: bool = False):
+        self.id, self.fails = id, fails
+
+    async def delete(self):
+        Row.active += 1
+        Row.max_active = max(Row.max_active, Row.active)
+        await asyncio.sleep(0.001)
+        Row.active -= 1
+        Row.deleted += 1
+        if self.fails:
+            raise ConnectionError("down")
+
+
+def test_bounded_deletes():
+    Row.active = Row.max_active = Row.deleted = 0
+    rows = [Row(i, fails=i in (3, 7)) for i in range(20)]
+
+    result = asyncio.run(DetaBase.delete_many(rows, concurrency=4))
+    assert Row.max_active == 4
+    assert result.processed == 18
+    assert result.failed == {"3": "down", "7": "down"}
+
+
+def test_no_read_ahead():
+    Row.active = Row.max_active = Row.deleted = 0
+    pulled = []
+
+    async def rows():
+        for i in range(10):
+            # At most one row waits for a slot, the others are pulled once a delete is done
+            assert len(pulled) - Row.deleted <= 3
+            pulled.append(i)
+            yield Row(i)
+
+    result = asyncio.run(DetaBase.delete_many(rows(), concurrency=3))
+    assert pulled == list(range(10))
+    assert result.processed == 10 and not result.failed
+
+
+class Item(DetaBase):
+    db_name = "items"
+
+
+def test_client_errors(monkeypatch):
+    deleted = []
+
+    async def delete(key: str):
+        if key.endswith("1"):
+            raise ClientResponseError(None, (), status=500)
+        deleted.append(key)
+
+    async def get(db_name: str):
+        return SimpleNamespace(delete=delete)
+
+    monkeypatch.setattr(base, "base_clients", SimpleNamespace(get=get))
+    items = [Item(id=f"00000000-0000-0000-0000-00000000000{i}") for i in range(4)]
+
+    result = asyncio.run(DetaBase.delete_many(items))
+    assert result.processed == 3 and len(deleted) == 3
+    assert list(result.failed) == [str(items[1].id)]
@@ -0,0 +1,16 @@
+from api.etag import etag_matches, make_etag
+
+
+def test_make_etag():
+    assert make_etag("a", "b") == make_etag("a", "b")
+    assert make_etag("a", "b") != make_etag("ab")
+
+
+def test_etag_matches():
+    etag = make_etag("a")
+
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'"other", W/{etag}', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('"other"', etag)
@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from api.models import base, counter, index, lookup
+from api.models.base import DetaBase
+from api.models.chapter import ScanGroup, ScanGroupRegistry
+from api.models.facets import FacetIndex
+from api.models.index import Index, SortedIndex, ascending_number, encode_value
+from api.models.lookup import CLAIM_TIMEOUT, UniqueIndex
+from api.tests.unit.utils import fake_clients
+
+
+class SlowIndex(Index):
+    builds = 0
+
+    async def rebuild(self, model):
+        self.builds += 1
+        await asyncio.sleep(0.01)
+        await self.mark_built()
+
+
+def test_single_build(monkeypatch):
+    bases = fake_clients(monkeypatch, index)
+
+    # Created outside of the loop, like the indexes of the models
+    test_index = SlowIndex("test", "index_test")
+
+    async def build():
+        await asyncio.gather(*(test_index.ensure_built(None) for _ in range(5)))
+        await SlowIndex("test", "index_test").ensure_built(None)
+
+    asyncio.run(build())
+    assert test_index.builds == 1
+    assert "test" in bases[index.INDEX_META_DB].items
+
+
+def test_scan_groups_lock(monkeypatch):
+    groups = fake_clients(monkeypatch, base)[ScanGroup.db_name]
+    groups.items["Group"] = {"key": "Group", "id": "Group"}
+    fetch = groups.fetch
+
+    async def slow_fetch(*args, **kwargs):
+        await asyncio.sleep(0.01)
+        return await fetch(*args, **kwargs)
+
+    groups.fetch = slow_fetch
+    # Created outside of the loop, like the registry of the chapters
+    registry = ScanGroupRegistry(60)
+
+    async def search():
+        return await asyncio.gather(registry.search("gr"), registry.search("x"))
+
+    assert asyncio.run(search()) == [["Group"], []]
+    assert groups.fetches == 1
+
+
+def test_cached_facet_counts(monkeypatch):
+    bases = fake_clients(monkeypatch, counter)
+    counters = bases[counter.COUNTERS_DB]
+    for key, value in ((f"test:status:{encode_value('ongoing')}", 2), (f"test:year:{encode_value(2020)}", 0)):
+        counters.items[key] = {"key": key, "value": value}
+
+    async def counts():
+        facets = FacetIndex("test", ("status", "year"), lambda instance: {})
+        facets.built = True
+        first, second = await facets.counts(None), await facets.counts(None)
+        facets.counts_expiry = 0.0
+        return first, second, await facets.counts(None)
+
+    first, second, third = asyncio.run(counts())
+    assert first == second == third == {"status": {"ongoing": 2}, "year": {}}
+    assert counters.fetches == 2
+
+
+class Item(DetaBase):
+    group: str
+    rank: int
+    db_name = "items"
+    indexes = (SortedIndex("items_by_group", lambda item: ascending_number(item.rank), lambda item: item.group),)
+
+
+def test_sorted_counts(monkeypatch):
+    fake_clients(monkeypatch, counter, index)
+    by_group = Item.indexes[0]
+    items = [Item(group=group, rank=rank) for group, rank in (("a", 1), ("a", 2), ("b", 1))]
+
+    async def counts():
+        return await by_group.count("a"), await by_group.count("b")
+
+    async def write():
+        await asyncio.gather(*(by_group.put(item) for item in items))
+        await by_group.put(items[0])
+        await by_group.delete(Item(group="a", rank=3))
+
+    asyncio.run(write())
+    assert asyncio.run(counts()) == (2, 1)
+
+    # The counters that drifted are fixed from the entries
+    asyncio.run(by_group.delete(items[2]))
+    asyncio.run(counter.set_count(by_group.counter_key("a"), 5))
+    asyncio.run(counter.set_count(by_group.counter_key("b"), 1))
+    asyncio.run(by_group.reconcile())
+    assert asyncio.run(counts()) == (2, None)
+
+    with pytest.raises(TypeError):
+        asyncio.run(Item.save_many(items))
+
+
+class Row:
+    rows = {}
+
+    def __init__(self, id: str, name: str, email: str):
+        self.id, self.name, self.email = id, name, email
+
+    @classmethod
+    async def find(cls, _id: str, exception=None):
+        return cls.rows.get(_id)
+
+
+def unique_index(monkeypatch):
+    bases = fake_clients(monkeypatch, lookup)
+    by_login = UniqueIndex("rows", {"name": lambda row: row.name, "email": lambda row: row.email}, HTTPException(409))
+    by_login.built = True
+    return by_login, bases[by_login.db_name]
+
+
+def test_unique_claims(monkeypatch):
+    by_login, lookups = unique_index(monkeypatch)
+    first, second = Row("1", "name", "first@example.com"), Row("2", "name", "second@example.com")
+
+    asyncio.run(by_login.claim(first))
+    assert {lookup["id"] for lookup in lookups.items.values()} == {"1"}
+
+    # The row keeps the values it owns, and the other one can't take them
+    asyncio.run(by_login.claim(first))
+    with pytest.raises(HTTPException):
+        asyncio.run(by_login.claim(second))
+    assert by_login.key("email", "second@example.com") not in lookups.items
+
+    asyncio.run(by_login.release(first, by_login.keys(Row("1", "name", "new@example.com"))))
+    assert set(lookups.items) == {by_login.key("name", "name")}
+
+
+def test_failed_claims_keep_owned_values(monkeypatch):
+    by_login, lookups = unique_index(monkeypatch)
+    asyncio.run(by_login.claim(Row("1", "first", "first@example.com")))
+    asyncio.run(by_login.claim(Row("2", "second", "second@example.com")))
+
+    # The row claims its values again along with one of the other row, only the new claims are rolled back
+    with pytest.raises(HTTPException):
+        asyncio.run(by_login.claim(Row("1", "first", "second@example.com")))
+    assert lookups.items[by_login.key("name", "first")]["id"] == "1"
+    assert lookups.items[by_login.key("email", "second@example.com")]["id"] == "2"
+
+
+def test_concurrent_claims(monkeypatch):
+    by_login, lookups = unique_index(monkeypatch)
+    rows = [Row(str(i), "name", f"{i}@example.com") for i in range(5)]
+
+    async def claim(row: Row):
+        try:
+            await by_login.claim(row)
+            return True
+        except HTTPException:
+            return False
+
+    async def claim_all():
+        return await asyncio.gather(*(claim(row) for row in rows))
+
+    assert sum(asyncio.run(claim_all())) == 1
+    assert len(lookups.items) == 2
+
+
+def test_abandoned_claims(monkeypatch):
+    by_login, lookups = unique_index(monkeypatch)
+    old = (datetime.now() - CLAIM_TIMEOUT * 2).isoformat()
+    for name, _id, claim_time in (("abandoned", "9", old), ("written", "8", old), ("pending", "7", None)):
+        key = by_login.key("name", name)
+        lookups.items[key] = {"key": key, "id": _id, "claim_time": claim_time or datetime.now().isoformat()}
+    Row.rows = {"8": Row("8", "written", "8@example.com")}
+
+    # Only the claim of a row that was never written is taken back, once it's old enough
+    asyncio.run(by_login.claim(Row("1", "abandoned", "1@example.com")))
+    assert lookups.items[by_login.key("name", "abandoned")]["id"] == "1"
+    for name in ("written", "pending"):
+        with pytest.raises(HTTPException):
+            asyncio.run(by_login.claim(Row("2", name, "2@example.com")))
+        assert lookups.items[by_login.key("name", name)]["id"] != "2"
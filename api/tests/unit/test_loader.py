@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from api.exceptions import NotFoundHTTPException
+from api.models.loader import Loader
+
+
+class Model:
+    calls = []
+    error = None
+
+    @classmethod
+    async def find_many(cls, keys: list[str]):
+        cls.calls.append(keys)
+        if cls.error:
+            raise cls.error
+        return {key: f"row {key}" for key in keys if key != "missing"}
+
+
+def test_coalesced_loads():
+    Model.calls, Model.error = [], None
+    loader = Loader(Model)
+
+    async def load():
+        rows = await asyncio.gather(loader.load("a"), loader.load("b"), loader.load("a"), loader.load("missing", None))
+        return rows, await loader.load_many(["a", "c"])
+
+    rows, more = asyncio.run(load())
+    assert rows == ["row a", "row b", "row a", None]
+    assert more == ["row a", "row c"]
+    assert Model.calls == [["a", "b", "missing"], ["c"]]
+
+
+def test_missing_load():
+    Model.calls, Model.error = [], None
+
+    with pytest.raises(NotFoundHTTPException):
+        asyncio.run(Loader(Model).load("missing"))
+
+
+def test_failed_loads():
+    Model.calls, Model.error = [], ConnectionError("down")
+    loader = Loader(Model)
+
+    async def load():
+        results = await asyncio.gather(loader.load("a"), loader.load("b"), return_exceptions=True)
+        Model.error = None
+        return results, await loader.load("a")
+
+    results, retried = asyncio.run(load())
+    # Every waiting lookup gets the error, and the failed keys are looked up again
+    assert all(isinstance(result, ConnectionError) for result in results)
+    assert retried == "row a"
+    assert Model.calls == [["a", "b"], ["a"]]
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from api import fs
+from api.exceptions import RangeNotSatisfiableHTTPException
+from api.fs import AsyncDrive, Drive, MediaCache, guess_type, page_path
+from api.images import accepts, negotiate, resize, variant_path
+from api.routers.media import parse_range
+from api.tests.unit.utils import LocalBase, LocalDrive, StreamingBody, local_drive
+
+
+def test_parse_range():
+    assert parse_range("bytes=0-99", 1000) == (0, 99)
+    assert parse_range("bytes=100-", 1000) == (100, 999)
+    assert parse_range("bytes=-10", 1000) == (990, 999)
+    assert parse_range("bytes=-5000", 1000) == (0, 999)
+    assert parse_range("bytes=900-5000", 1000) == (900, 999)
+
+
+def test_ignored_range():
+    assert parse_range(None, 1000) is None
+    assert parse_range("bytes=0-99", None) is None
+    assert parse_range("bytes=5-1", 1000) is None
+    assert parse_range("bytes=0-1,5-6", 1000) is None
+    assert parse_range("items=0-1", 1000) is None
+
+
+def test_unsatisfiable_range():
+    for header, size in [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=0-", 0)]:
+        with pytest.raises(RangeNotSatisfiableHTTPException):
+            parse_range(header, size)
+
+
+def test_guess_type():
+    assert guess_type("pages/1.jpg", b"\x89PNG\r\n\x1a\n...") == "image/png"
+    assert guess_type("cover.png", b"\xff\xd8\xff\xe0") == "image/jpeg"
+    assert guess_type("a", b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert guess_type("a", b"\x00\x00\x00\x1cftypavif") == "image/avif"
+    assert guess_type("legacy.webp") == "image/webp"
+    assert guess_type("unknown") == "application/octet-stream"
+
+
+class Files:
+    def __init__(self, files: dict[str, bytes]):
+        self.files = files
+        self.gets = []
+
+    def get(self, path: str):
+        self.gets.append(path)
+        return StreamingBody(self.files[path])
+
+
+def test_media_cache(tmp_path):
+    cache = MediaCache(str(tmp_path / "cache"), 10)
+    files = Files({"a": b"aaaa", "b": b"bbbb", "c": b"cccc", "big": b"x" * 11})
+    drive = AsyncDrive(files, ThreadPoolExecutor(2))
+
+    async def fetch(*paths):
+        return await asyncio.gather(*(cache.fetch(drive, path) for path in paths))
+
+    local_a, _ = asyncio.run(fetch("a", "a"))
+    assert open(local_a, "rb").read() == b"aaaa"
+    assert files.gets == ["a"]
+
+    for path in ("b", "a", "c"):
+        asyncio.run(fetch(path))
+    assert list(cache.entries) == ["a", "c"] and cache.size == 8
+
+    cache.invalidate(["a"])
+    assert cache.get("a") is None and cache.size == 4
+    assert asyncio.run(fetch("big")) == [None]
+    assert len(os.listdir(cache.root)) == 1
+
+    # The copies of the processes that exited are removed with the ones of this process
+    os.makedirs(tmp_path / "cache" / "999999999")
+    (tmp_path / "cache" / "legacy").write_bytes(b"")
+    cache.clear()
+    assert not os.listdir(tmp_path / "cache") and not cache.entries
+
+
+def test_cached_stat(tmp_path):
+    drive = local_drive(cache=MediaCache(str(tmp_path), 10))
+    media = AsyncDrive(drive, ThreadPoolExecutor(1))
+    page = page_path("a" * 64)
+    for path in (page, variant_path(page, 320), "cover.jpg"):
+        drive.put(path, b"file")
+    stats = []
+    drive.meta.get = lambda key: stats.append(key) or LocalBase.get(drive.meta, key)
+
+    async def stat(*paths):
+        return [await media.cached_stat(path) for path in paths]
+
+    asyncio.run(stat(page, page, variant_path(page, 320), variant_path(page, 320), "cover.jpg", "cover.jpg"))
+    assert len(stats) == 4
+
+    # The metadata of a page changes once its encodings are made
+    drive.update_meta(page, encodings={})
+    assert asyncio.run(stat(page, page))[1]["encodings"] == {}
+    assert len(stats) == 5
+
+
+def test_store_page():
+    drive = local_drive()
+    drive.put("blobs/a.jpg", b"page")
+    drive.put("blobs/b.jpg", b"page")
+
+    digest = drive.content_hash("blobs/a.jpg")
+    assert digest == drive.content_hash("blobs/b.jpg") == sha256(b"page").hexdigest()
+    assert drive.store_page("blobs/a.jpg", digest)
+    assert not drive.store_page("blobs/b.jpg", digest)
+    assert not drive.store_page(page_path(digest), digest)
+    assert drive.drive.files[page_path(digest)] == b"page"
+
+    # The files written before the metadata are hashed from their content
+    drive.drive.files["legacy.jpg"] = b"legacy"
+    assert drive.content_hash("legacy.jpg") == sha256(b"legacy").hexdigest()
+
+    # Only the variants of the files themselves are listed
+    drive.drive.files.update({f"variants/pages/{i}.jpg/w320.jpg": b"" for i in range(10)})
+    listed = []
+    drive.drive.list = lambda prefix, last=None: listed.append(prefix) or LocalDrive.list(drive.drive, prefix)
+    drive.put(page_path("other"), b"other")
+    drive.remove([page_path("other")])
+    assert listed == ["variants/pages/other.jpg/"]
+
+
+def test_remove_variants():
+    drive = local_drive()
+    for i in range(1, 4):
+        drive.put(f"m/c/{i}.jpg", b"page")
+        drive.put(f"variants/m/c/{i}.jpg/w320.jpg", b"variant")
+    listed = []
+    drive.drive.list = lambda prefix, last=None: listed.append(prefix) or LocalDrive.list(drive.drive, prefix)
+
+    drive.remove(["m/c/1.jpg", "m/c/2.jpg"])
+    assert listed == ["variants/m/c/"]
+    assert sorted(drive.drive.files) == ["m/c/3.jpg", "variants/m/c/3.jpg/w320.jpg"]
+    assert not drive.stat("m/c/1.jpg") and not drive.stat("variants/m/c/2.jpg/w320.jpg")
+    assert drive.stat("variants/m/c/3.jpg/w320.jpg")
+
+
+def test_multipart_copy(monkeypatch):
+    monkeypatch.setattr(fs, "UPLOAD_PART_SIZE", 1000)
+    monkeypatch.setattr(fs, "COPY_CHUNK_SIZE", 300)
+    drive = local_drive()
+    data = bytes(range(256)) * 10
+    drive.put("big.jpg", data)
+
+    drive.copy("big.jpg", "copy.jpg")
+    assert drive.drive.files["copy.jpg"] == data
+    assert [part for *_, part in drive.drive.parts] == [1, 2, 3]
+    assert drive.stat("copy.jpg")["etag"] == f'"{sha256(data).hexdigest()}"'
+    assert drive.stat("copy.jpg")["size"] == len(data)
+
+
+def test_thread_clients():
+    drive = Drive("test")
+    drive.connect = lambda: (object(), object())
+    barrier = threading.Barrier(3)
+
+    def clients(_):
+        barrier.wait()
+        return drive.drive, drive.meta, drive.drive
+
+    with ThreadPoolExecutor(3) as executor:
+        results = list(executor.map(clients, range(3)))
+    assert all(first is again for first, _, again in results)
+    assert len({id(client) for result in results for client in result}) == 6
+
+
+def test_variants():
+    assert variant_path("manga/cover.jpg", 320, None) == "variants/manga/cover.jpg/w320.jpg"
+    assert variant_path("manga/cover.jpg", 320, 160) == "variants/manga/cover.jpg/w320h160.jpg"
+
+    image = BytesIO()
+    Image.new("RGBA", (800, 1200)).save(image, "PNG")
+    for size, expected in [((320, None), (320, 480)), ((None, 160), (107, 160)), ((1280, None), (800, 1200))]:
+        image.seek(0)
+        with resize(image, *size) as f, Image.open(f) as variant:
+            assert (variant.format, variant.size) == ("JPEG", expected)
+
+
+def test_negotiate():
+    chrome = "image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8"
+    assert accepts(chrome, "image/webp")
+    assert not accepts("*/*", "image/webp")
+    assert not accepts("image/webp;q=0", "image/webp")
+
+    meta = {"size": 1000, "encodings": {"webp": 600}}
+    assert negotiate(meta, chrome) == "webp"
+    assert negotiate(meta, "image/*") is None
+    assert negotiate({"size": 1000}, chrome) is None
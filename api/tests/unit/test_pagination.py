@@ -0,0 +1,29 @@
+import pytest
+
+from api.exceptions import BadRequestHTTPException
+from api.models.pagination import decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("manga_by_create_time", "20220101000000000000#1e01d7f6-c4e1-4102-9dd0-a6fccc065978")
+
+    assert "=" not in cursor
+    assert decode_cursor("manga_by_create_time", cursor) == "20220101000000000000#1e01d7f6-c4e1-4102-9dd0-a6fccc065978"
+
+
+def test_cursor_missing():
+    assert decode_cursor("manga_by_create_time", None) is None
+    assert decode_cursor("manga_by_create_time", "") is None
+
+
+def test_cursor_wrong_index():
+    cursor = encode_cursor("users_by_username", "admin#c603ef4f-08f9-4130-a770-3a34defa44b3")
+
+    with pytest.raises(BadRequestHTTPException):
+        decode_cursor("manga_by_create_time", cursor)
+
+
+def test_cursor_invalid():
+    for cursor in ("not a cursor", "e30", "W10"):
+        with pytest.raises(BadRequestHTTPException):
+            decode_cursor("manga_by_create_time", cursor)
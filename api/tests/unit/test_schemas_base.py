@@ -12,7 +12,18 @@ class TestPaginationResponse(BaseModelTest):
         "limit": settings.max_page_limit,
         "results": [],
         "total": 10,
+        "next_cursor": "eyJpIjoibWFuZ2EiLCJsIjoia2V5In0",
     }
+    correct_data = [
+        # Last page
+        {
+            "offset": 2,
+            "limit": settings.max_page_limit,
+            "results": [],
+            "total": 10,
+            "next_cursor": None,
+        },
+    ]
     wrong_data = [
         # Missing fields
         {
@@ -68,17 +79,20 @@ class TestPaginationResponse(BaseModelTest):
             "limit": str(settings.max_page_limit),
             "results": [],
             "total": 10,
+            "next_cursor": "eyJpIjoibWFuZ2EiLCJsIjoia2V5In0",
         },
         {
             "offset": "2",
             "limit": settings.max_page_limit,
             "results": [],
             "total": 10,
+            "next_cursor": "eyJpIjoibWFuZ2EiLCJsIjoia2V5In0",
         },
         {
             "offset": 2,
             "limit": settings.max_page_limit,
             "results": [],
             "total": "10",
+            "next_cursor": "eyJpIjoibWFuZ2EiLCJsIjoia2V5In0",
         },
     ]
@@ -91,7 +91,37 @@ class TestChapterResponse(BaseModelTest):
         "id": UUID("4abe53f4-0eaa-4f31-9210-a625fa665e23"),
         "upload_time": datetime(2000, 8, 24),
         "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
+        "status": "ready",
+        "pages": [],
+        "stored_pages": None,
+        "failed_pages": [],
     }
+    correct_data = [
+        {
+            "length": 15,
+            "manga_id": UUID("1e01d7f6-c4e1-4102-9dd0-a6fccc065978"),
+            "version": 2,
+            "id": UUID("4abe53f4-0eaa-4f31-9210-a625fa665e23"),
+            "upload_time": datetime(2000, 8, 24),
+            "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
+            "status": "processing",
+            "pages": ["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"],
+            "stored_pages": 3,
+            "failed_pages": [],
+        },
+        {
+            "length": 15,
+            "manga_id": UUID("1e01d7f6-c4e1-4102-9dd0-a6fccc065978"),
+            "version": 2,
+            "id": UUID("4abe53f4-0eaa-4f31-9210-a625fa665e23"),
+            "upload_time": datetime(2000, 8, 24),
+            "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
+            "status": "failed",
+            "pages": [],
+            "stored_pages": None,
+            "failed_pages": [2, 7],
+        },
+    ]
     wrong_data = [
         # Missing fields
         {
@@ -129,6 +159,16 @@ class TestChapterResponse(BaseModelTest):
             "id": UUID("4abe53f4-0eaa-4f31-9210-a625fa665e23"),
             "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
         },
+        # Unknown status
+        {
+            "length": 15,
+            "manga_id": UUID("1e01d7f6-c4e1-4102-9dd0-a6fccc065978"),
+            "version": 2,
+            "id": UUID("4abe53f4-0eaa-4f31-9210-a625fa665e23"),
+            "upload_time": datetime(2000, 8, 24),
+            "owner_id": UUID("3f01d7dd-c4e1-4102-9dd0-a6fccc065978"),
+            "status": "moving",
+        },
     ]
     irregular_data = [
         # String to number
@@ -146,7 +146,39 @@ class TestMangaResponse(BaseModelTest):
     ]
 
 
+class TestMangaFacets(BaseModelTest):
+    schema = sch.MangaFacets
+    example_data = {
+        "status": {"ongoing": 1},
+        "year": {"2021": 1},
+        "author": {"Hibiki Mio": 1},
+        "artist": {"Hibiki Mio": 1},
+    }
+    correct_data = [
+        # No matches
+        {"status": {}, "year": {}, "author": {}, "artist": {}},
+    ]
+    wrong_data = [
+        # Missing facet
+        {"status": {"ongoing": 1}, "year": {"2021": 1}, "author": {"Hibiki Mio": 1}},
+        # Non numeric count
+        {**example_data, "status": {"ongoing": "many"}},
+    ]
+    irregular_data = [
+        # Year and count as numbers
+        {**example_data, "year": {2021: "1"}},
+    ]
+
+
 class TestMangaSearchResponse(BaseModelTest):
     schema = sch.MangaSearchResponse
     parent = TestPaginationResponse
-    example_data = {**parent.example_data, "results": [TestMangaResponse.example_data]}
+    example_data = {
+        **parent.example_data,
+        "results": [TestMangaResponse.example_data],
+        "facets": TestMangaFacets.example_data,
+    }
+    wrong_data = [
+        # Missing facets
+        {"results": [TestMangaResponse.example_data]},
+    ]
@@ -0,0 +1,76 @@
+import asyncio
+
+from api.models import base, counter, index
+from api.models.base import DetaBase
+from api.models.search import SearchIndex, matches, normalize, required_trigrams, similarity, trigrams
+from api.tests.unit.utils import fake_clients
+
+
+def test_normalize():
+    assert normalize("Pokémon: The_Adventures!") == ["pokemon", "the", "adventures"]
+    assert normalize("!!") == []
+
+
+def test_required_trigrams():
+    assert required_trigrams(["piece"]) == {"pie", "iec", "ece"}
+    assert required_trigrams(["on"]) == {"__o", "_on"}
+
+
+def test_matches():
+    title = normalize("One Punch Man")
+
+    assert matches(normalize("unch"), title)
+    assert matches(normalize("on ma"), title)
+    assert not matches(normalize("n"), title)
+    assert not matches(normalize("piece"), title)
+
+
+def test_similarity():
+    query = trigrams(normalize("one"))
+
+    assert similarity(query, trigrams(normalize("One"))) == 1
+    assert similarity(query, trigrams(normalize("One Piece"))) > similarity(query, trigrams(normalize("Someone")))
+
+
+class Title(DetaBase):
+    title: str
+    db_name = "titles"
+
+
+def test_search(monkeypatch):
+    bases = fake_clients(monkeypatch, base, counter, index)
+    by_title = SearchIndex("titles", lambda row: row.title)
+    rows = [Title(title=title) for title in ("One Piece", "One Punch Man", "Someone", "Pieces")]
+    asyncio.run(Title.save_many(rows))
+    entries = bases[by_title.db_name]
+    queries = []
+    fetch = entries.fetch
+
+    async def record(query, **kwargs):
+        queries.append(query)
+        return await fetch(query, **kwargs)
+
+    monkeypatch.setattr(entries, "fetch", record)
+
+    async def titles(text):
+        return [record["words"] for record in await by_title.search(Title, text)]
+
+    # The first search builds the index and counts the trigrams
+    assert asyncio.run(titles("one")) == [["one", "piece"], ["one", "punch", "man"], ["someone"]]
+    queries.clear()
+    assert asyncio.run(titles("pie")) == [["pieces"], ["one", "piece"]]
+    # "pie" and "iec" are in 2 titles, "ece" in 3
+    assert queries in ([{"key?pfx": "pie#"}], [{"key?pfx": "iec#"}])
+
+    async def update():
+        await by_title.replace(rows[3], Title(id=rows[3].id, title="Pies"))
+        await by_title.delete(rows[0])
+
+    asyncio.run(update())
+    assert asyncio.run(titles("pie")) == [["pies"]]
+    assert asyncio.run(counter.get_count("titles:iec")) == 0
+
+    # The counters that drifted are fixed from the entries
+    asyncio.run(counter.set_count("titles:pie", 5))
+    asyncio.run(by_title.reconcile())
+    assert asyncio.run(counter.get_count("titles:pie")) == 1
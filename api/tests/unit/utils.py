@@ -1,6 +1,14 @@
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Optional
+
 import pytest
+from aiohttp import ClientResponseError
 from pydantic import ValidationError
 
+from api.fs import Drive, MediaCache
+
 
 def parent_setup(self):
     if self.parent:
@@ -38,3 +46,146 @@ class BaseModelTest:
             print("Irregular:", irregular)
             print("Parsed:", self.schema(**irregular))
             assert self.schema(**irregular) == self.example_data
+
+
+class Increment:
+    def __init__(self, amount: int = 1):
+        self.amount = amount
+
+
+class FakeBase:
+    """In-memory stand-in for the async client of a Deta Base"""
+
+    util = SimpleNamespace(increment=Increment)
+
+    def __init__(self):
+        self.items = {}
+        self.fetches = 0
+
+    async def get(self, key: str):
+        return self.items.get(key)
+
+    async def put(self, data: dict, key: Optional[str] = None):
+        key = key or data["key"]
+        self.items[key] = {**data, "key": key}
+        return self.items[key]
+
+    async def insert(self, data: dict, key: Optional[str] = None):
+        key = key or data["key"]
+        if key in self.items:
+            raise ClientResponseError(None, (), status=409)
+        return await self.put(data, key)
+
+    async def put_many(self, items: list[dict]):
+        for item in items:
+            await self.put(item)
+
+    async def update(self, updates: dict, key: str):
+        if key not in self.items:
+            raise ClientResponseError(None, (), status=404)
+        item = self.items[key]
+        for field, value in updates.items():
+            item[field] = item.get(field, 0) + value.amount if isinstance(value, Increment) else value
+
+    async def delete(self, key: str):
+        self.items.pop(key, None)
+
+    async def fetch(self, query: dict, limit: int = 1000, last: Optional[str] = None):
+        """Supports the prefix queries on the keys and the equality on the fields, in a single page"""
+        self.fetches += 1
+        prefix = query.get("key?pfx", "")
+        items = [
+            item
+            for key, item in sorted(self.items.items())
+            if key.startswith(prefix)
+            and all(item.get(field) == value for field, value in query.items() if "?" not in field)
+        ]
+        return SimpleNamespace(items=items, last=None)
+
+
+def fake_clients(monkeypatch, *modules):
+    """Replaces the Deta clients used by the modules with in-memory Bases, returned by name"""
+    bases = defaultdict(FakeBase)
+
+    @asynccontextmanager
+    async def async_client(db_name: str):
+        yield bases[db_name]
+
+    for module in modules:
+        monkeypatch.setattr(module, "async_client", async_client)
+    return bases
+
+
+class StreamingBody:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def iter_chunks(self, chunk_size: int):
+        yield from (self.data[i:][:chunk_size] for i in range(0, len(self.data), chunk_size))
+
+    def close(self):
+        pass
+
+
+class LocalDrive:
+    """In-memory stand-in for the sync client of a Deta Drive, with the methods used by `api.fs.Drive`"""
+
+    def __init__(self):
+        self.files = {}
+        self.uploads = {}
+        self.parts = []
+
+    def put(self, name: str, data):
+        self.files[name] = data.read() if hasattr(data, "read") else bytes(data)
+
+    def get(self, name: str):
+        return StreamingBody(self.files[name]) if name in self.files else None
+
+    def delete_many(self, names: list[str]):
+        for name in names:
+            self.files.pop(name, None)
+
+    def list(self, prefix: str, last: Optional[str] = None):
+        return {"names": sorted(name for name in self.files if name.startswith(prefix))}
+
+    def _start_upload(self, name: str):
+        upload_id = f"upload_{len(self.uploads)}"
+        self.uploads[upload_id] = []
+        return upload_id
+
+    def _upload_part(self, name: str, chunk: bytes, upload_id: str, part: int):
+        self.parts.append((name, upload_id, part))
+        self.uploads[upload_id].append(chunk)
+
+    def _finish_upload(self, name: str, upload_id: str):
+        self.files[name] = b"".join(self.uploads.pop(upload_id))
+
+    def _abort_upload(self, name: str, upload_id: str):
+        del self.uploads[upload_id]
+
+
+class LocalBase:
+    """In-memory stand-in for the sync client of a Deta Base"""
+
+    def __init__(self):
+        self.items = {}
+
+    def put(self, item: dict):
+        self.items[item["key"]] = item
+
+    def get(self, key: str):
+        return self.items.get(key)
+
+    def update(self, updates: dict, key: str):
+        self.items[key].update(updates)
+
+    def delete(self, key: str):
+        self.items.pop(key, None)
+
+
+def local_drive(name: str = "test", cache: Optional[MediaCache] = None):
+    """A Drive whose threads share the same in-memory clients"""
+    drive = Drive(name, cache=cache)
+    clients = LocalDrive(), LocalBase()
+    drive.connect = lambda: clients
+    return drive
@@ -29,6 +29,9 @@ fi
 if [ "$1" = "create_admin" ]; then
   echo "Creating an admin user..."
   python /api/create_admin.py
+elif [ "$1" = "rebuild_indexes" ]; then
+  echo "Rebuilding the indexes..."
+  python -m api.rebuild_indexes
 else
   echo "Starting the API..."
   exec "$@"